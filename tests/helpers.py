@@ -0,0 +1,23 @@
+# Shared helpers for the tests
+
+import importlib.util
+import os
+import sys
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the functions import wikipedia_enrich_core from the root directory
+if ROOT_PATH not in sys.path:
+    sys.path.insert(0, ROOT_PATH)
+
+def load_module(file_name):
+    # the scripts are standalone files, so load them by path; each call
+    # loads a fresh copy, along with a fresh copy of the core module the
+    # functions share, so the module state isn't shared between tests
+    sys.modules.pop('wikipedia_enrich_core', None)
+    name = 'test_' + file_name[:-3].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_PATH, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,92 @@
+# Tests for the persistent cache of the people and org functions
+#
+# usage:
+#   python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from helpers import load_module
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, 'cache.sqlite')
+        self.people = self.get_function('wikipedia-enrich-people.py')
+        self.org = self.get_function('wikipedia-enrich-org.py')
+
+    def tearDown(self):
+        for function in (self.people, self.org):
+            if function.core.cache_connection is not None:
+                function.core.cache_connection.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def get_function(self, file_name):
+        function = load_module(file_name)
+        function.core.CACHE_PATH = self.cache_path
+        return function
+
+    def get_cached_search_ids(self, function, searches):
+        search_candidate_ids, searched = function.enricher.get_search_candidate_ids(None, searches, 'en', use_index=False)
+        return search_candidate_ids
+
+    def put_cache_value(self, function, kind, value):
+        entity = value['entity']
+        function.core.put_cache_values(function.enricher.get_cache_kind(kind), [(entity['id'], entity['id'], entity['modified'], value)])
+
+    def get_cache_values(self, function, kind, keys):
+        return function.core.get_cache_values(function.enricher.get_cache_kind(kind), keys)
+
+    def test_search_namespace(self):
+        # the item a function chose for a search term isn't used by the other
+        self.people.enricher.put_search_item_ids(['Harbor Systems', 'nobody'], {'Harbor Systems': 'Q1'}, 'en')
+        self.org.enricher.put_search_item_ids(['Harbor Systems'], {'Harbor Systems': 'Q2'}, 'en')
+        self.assertEqual(self.get_cached_search_ids(self.people, ['Harbor Systems', 'nobody']), {'Harbor Systems': ['Q1'], 'nobody': []})
+        self.assertEqual(self.get_cached_search_ids(self.org, ['Harbor Systems']), {'Harbor Systems': ['Q2']})
+
+    def test_entity_namespace(self):
+        # the entities only keep the claims the function uses, so the entities
+        # cached by a function aren't used by the other; labels are shared
+        entity = {'id': 'Q1', 'modified': '2020-01-01T00:00:00Z', 'labels': {'en': {'language': 'en', 'value': 'Harbor Systems'}}, 'claims': {}}
+        value = {'props': 'info|labels|claims', 'languages': ['en'], 'entity': entity}
+        self.put_cache_value(self.people, 'entity', value)
+        self.put_cache_value(self.people, 'labels', value)
+        self.assertEqual(self.get_cache_values(self.people, 'entity', ['Q1']), {'Q1': value})
+        self.assertEqual(self.get_cache_values(self.org, 'entity', ['Q1']), {})
+        self.assertEqual(self.get_cache_values(self.org, 'labels', ['Q1']), {'Q1': value})
+
+    def test_search_index_from_cache(self):
+        # search terms cached without an item aren't loaded into the index
+        self.people.enricher.put_search_item_ids(['JS Bach', 'nobody'], {'JS Bach': 'Q1339'}, 'en')
+        function = self.get_function('wikipedia-enrich-people.py')
+        index = function.enricher.get_search_index()
+        self.assertEqual(index.lookup('en', 'JS Bach'), 'Q1339')
+        self.assertIsNone(index.lookup('en', 'nobody'))
+        self.assertEqual(function.enricher.get_search_candidate_ids(None, ['nobody'], 'en'), ({'nobody': []}, []))
+        function.core.cache_connection.close()
+
+    def test_search_index_leaves_out_labels(self):
+        # the labels of the cached items, whether they were only fetched as
+        # candidates or chosen for another search term, don't resolve a search
+        for item_id, label in (('Q89', 'Apple'), ('Q3308285', 'Michael Jordan')):
+            entity = {'id': item_id, 'modified': '2020-01-01T00:00:00Z', 'labels': {'en': {'language': 'en', 'value': label}}, 'claims': {}}
+            value = {'props': 'info|labels|claims', 'languages': ['en'], 'entity': entity}
+            self.put_cache_value(self.org, 'entity', value)
+            self.put_cache_value(self.people, 'entity', value)
+        self.people.enricher.put_search_item_ids(['Michael I. Jordan'], {'Michael I. Jordan': 'Q3308285'}, 'en')
+        self.assertIsNone(self.people.enricher.get_search_index().lookup('en', 'Michael Jordan'))
+
+        org = self.get_function('wikipedia-enrich-org.py')
+        self.assertIsNone(org.enricher.get_search_index().lookup('en', 'Apple'))
+        people = self.get_function('wikipedia-enrich-people.py')
+        index = people.enricher.get_search_index()
+        self.assertIsNone(index.lookup('en', 'Michael Jordan'))
+        self.assertEqual(index.lookup('en', 'Michael I. Jordan'), 'Q3308285')
+        for function in (org, people):
+            function.core.cache_connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+# Tests for reading the input rows of wikipedia-enrich-cli.py
+#
+# usage:
+#   python -m pytest tests
+
+import io
+import unittest
+
+from helpers import load_module
+
+class ReadRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cli = load_module('wikipedia-enrich-cli.py')
+
+    def test_csv(self):
+        rows = list(self.cli.read_rows(io.StringIO('id,name\n1,JS Bach\n2\n'), 'csv', 'name'))
+        self.assertEqual(rows, [{'row': 1, 'search': 'JS Bach', 'properties': None}, {'row': 2, 'search': '', 'properties': None}])
+
+    def test_ndjson_properties(self):
+        # the properties of a row can be a string or a list
+        lines = '"Google"\n{"search": "JS Bach", "properties": ["label", "citizenship"]}\n{"search": "Google", "properties": "label, website"}\n'
+        rows = list(self.cli.read_rows(io.StringIO(lines), 'ndjson', None))
+        self.assertEqual([row['properties'] for row in rows], [None, 'label,citizenship', 'label, website'])
+
+if __name__ == '__main__':
+    unittest.main()
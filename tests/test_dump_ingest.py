@@ -0,0 +1,89 @@
+# Builds an entity store from a small synthetic Wikidata dump with
+# wikidata-dump-ingest.py and enriches rows against it with the people and
+# org functions
+#
+# usage:
+#   python -m pytest tests
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from helpers import ROOT_PATH, load_module
+
+DUMP_PATH = os.path.join(ROOT_PATH, 'tests', 'fixtures', 'wikidata-dump-sample.json')
+
+class DumpIngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ingest = load_module('wikidata-dump-ingest.py')
+        self.store_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.store_dir, 'store.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def write_store(self, languages=('en', 'de')):
+        return self.ingest.write_store(self.ingest.read_dump_entities(DUMP_PATH), self.store_path, list(languages), batch_size=4)
+
+    def get_function(self, file_name):
+        function = load_module(file_name)
+        function.core.ENTITY_STORE_PATH = self.store_path
+        function.core.CACHE_PATH = ''
+        return function
+
+    def enrich(self, function, search, properties, language='en'):
+        rows = function.core.get_input_rows(search, function.core.get_property_names(properties))
+        return function.enricher.enrich_rows(rows, function.core.get_languages([language]))
+
+    def test_write_store(self):
+        # only items are written, with the parts the functions use
+        self.assertEqual(self.write_store(), 9)
+        connection = sqlite3.connect(self.store_path)
+        entity = self.ingest.loads_json(connection.execute("select entity from entities where id = 'Q1339'").fetchone()[0])
+        self.assertEqual(sorted(entity['labels'].keys()), ['de', 'en'])
+        self.assertEqual(sorted(entity['sitelinks'].keys()), ['dewiki', 'enwiki'])
+        self.assertNotIn('P18', entity['claims'])
+        self.assertNotIn('references', entity['claims']['P106'][0])
+        self.assertIsNone(connection.execute("select id from entities where id = 'P31'").fetchone())
+
+        # the names include the aliases and are indexed by id
+        names = [r[0] for r in connection.execute("select name from names where id = 'Q1339' and language = 'en'")]
+        self.assertEqual(sorted(names), ['j. s. bach', 'johann sebastian bach', 'js bach'])
+        indexes = [r[1] for r in connection.execute("pragma index_list('names')")]
+        self.assertIn('names_id', indexes)
+        connection.close()
+
+    def test_write_store_again(self):
+        # writing an entity again replaces its names
+        query = "select count(*) from names where id = 'Q1339'"
+        self.write_store()
+        connection = sqlite3.connect(self.store_path)
+        count = connection.execute(query).fetchone()[0]
+        connection.close()
+        self.write_store()
+        connection = sqlite3.connect(self.store_path)
+        self.assertEqual(connection.execute(query).fetchone()[0], count)
+        connection.close()
+
+    def test_enrich_people_from_store(self):
+        self.write_store()
+        people = self.get_function('wikipedia-enrich-people.py')
+        result = self.enrich(people, [['JS Bach'], ['nobody']], ['label', 'citizenship', 'occupation', 'birth_date', 'wikipedia_url'])
+        self.assertEqual(result[0], ['Johann Sebastian Bach', 'Germany', 'composer, pianist', '+1685-03-31T00:00:00Z',
+                                     'https://en.wikipedia.org/wiki/Johann_Sebastian_Bach'])
+        self.assertEqual(result[1], [''])
+
+        result = self.enrich(people, 'Johann Sebastian Bach', ['label', 'citizenship'], 'de')
+        self.assertEqual(result, [['Johann Sebastian Bach', 'Deutschland']])
+
+    def test_enrich_org_from_store(self):
+        self.write_store()
+        org = self.get_function('wikipedia-enrich-org.py')
+        result = self.enrich(org, 'Google LLC', ['label', 'website', 'country', 'inception'])
+        self.assertEqual(result, [['Google', 'https://www.google.com/', 'United States of America', '+1998-09-04T00:00:00Z']])
+
+if __name__ == '__main__':
+    unittest.main()
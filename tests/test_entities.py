@@ -0,0 +1,70 @@
+# Tests for the entity requests and claims of the people and org functions
+#
+# usage:
+#   python -m pytest tests
+
+import unittest
+
+from helpers import load_module
+
+class EntityRequestIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+
+    def test_packing(self):
+        # the ids are packed into as few requests as possible, 50 at a time
+        ids = ['Q%d' % i for i in range(120)]
+        request_ids = self.core.get_entity_request_ids(ids, {}, 'labels')
+        self.assertEqual([len(r.split('|')) for r in request_ids], [50, 50, 20])
+        self.assertEqual('|'.join(request_ids).split('|'), ids)
+
+    def test_pending_ids(self):
+        # ids that are repeated or already have the parts we need aren't requested
+        content = {'entities': {
+            'Q1': {'id': 'Q1', 'labels': {}, 'claims': {}},
+            'Q2': {'id': 'Q2', 'labels': {}},
+            'Q3': {'id': 'Q3', 'missing': ''}
+        }}
+        ids = ['Q1', 'Q2', 'Q3', 'Q4', 'Q4']
+        self.assertEqual(self.core.get_entity_request_ids(ids, content, 'labels|claims'), ['Q2|Q4'])
+        self.assertEqual(self.core.get_entity_request_ids(['Q1'], content, 'labels|claims'), [])
+
+class ClaimStatementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+
+    def get_statement(self, item_id, rank='normal', end_time=False):
+        statement = {'mainsnak': {'datavalue': {'value': {'id': item_id}}}, 'rank': rank}
+        if end_time:
+            statement['qualifiers'] = {'P582': [{'datavalue': {'value': {'time': '+2000-01-01T00:00:00Z'}}}]}
+        return statement
+
+    def get_ids(self, statements, claim_property):
+        statements = self.core.get_claim_statements(statements, claim_property, 'en')
+        return [s['mainsnak']['datavalue']['value']['id'] for s in statements]
+
+    def test_rank(self):
+        # the preferred statements are used instead of the normal ones
+        statements = [self.get_statement('Q1'), self.get_statement('Q2', 'preferred'), self.get_statement('Q3', 'preferred')]
+        self.assertEqual(self.get_ids(statements, {'type': 'item'}), ['Q2'])
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'joined'}), ['Q2', 'Q3'])
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'first'}), ['Q1'])
+
+    def test_deprecated(self):
+        # deprecated statements are left out, unless the first statement is used
+        statements = [self.get_statement('Q1', 'deprecated'), self.get_statement('Q2')]
+        self.assertEqual(self.get_ids(statements, {'type': 'item'}), ['Q2'])
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'all'}), ['Q2'])
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'first'}), ['Q1'])
+        self.assertEqual(self.get_ids(statements[:1], {'type': 'item'}), [])
+
+    def test_current(self):
+        # with current, statements with an end time are left out
+        statements = [self.get_statement('Q1', end_time=True), self.get_statement('Q2'), self.get_statement('Q3', 'preferred', end_time=True)]
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'joined', 'current': True}), ['Q2'])
+        self.assertEqual(self.get_ids(statements, {'type': 'item', 'values': 'joined'}), ['Q3'])
+
+if __name__ == '__main__':
+    unittest.main()
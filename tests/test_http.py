@@ -0,0 +1,221 @@
+# Tests for the http layer of the enrichment functions against a local server
+#
+# usage:
+#   python -m pytest tests
+
+import http.server
+import threading
+import time
+import unittest
+
+from helpers import load_module
+
+class FlakyServer(http.server.ThreadingHTTPServer):
+
+    # fails the first request to each path with a 502 response, or with a
+    # delay, answers the first request to each path after the delay, or with
+    # a retry_after, throttles the first request to each path with a 429
+    # response with the Retry-After header
+    daemon_threads = True
+
+    def __init__(self, delay=0, retry_after=None):
+        super().__init__(('127.0.0.1', 0), FlakyRequestHandler)
+        self.delay = delay
+        self.retry_after = retry_after
+        self.failed_paths = set()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+class FlakyRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            self.respond()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self):
+        headers = {}
+        if self.path not in self.server.failed_paths:
+            self.server.failed_paths.add(self.path)
+            if self.server.retry_after is not None:
+                status, body = 429, b'too many requests'
+                headers['Retry-After'] = self.server.retry_after
+            elif self.server.delay > 0:
+                time.sleep(self.server.delay)
+                status, body = 200, b'{"success": 1}'
+            else:
+                status, body = 502, b'bad gateway'
+        else:
+            status, body = 200, b'{"success": 1}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def start_server(self, delay=0, retry_after=None):
+        self.server = FlakyServer(delay, retry_after)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/w/api.php?action=wbgetentities' % self.server.server_address[1]
+
+    def test_session_retries_are_counted(self):
+        self.start_server()
+        core = load_module('wikipedia_enrich_core.py')
+        session = core.requests_retry_session(backoff_factor=0)
+        self.assertEqual(core.get_json_request(session, self.url), {'success': 1})
+        counters = core.metrics.get_stats()['counters']
+        self.assertEqual(counters.get('http.retries'), 1)
+        self.assertEqual(counters.get('http.requests'), 1)
+
+    def test_first_try_gets_the_deadline(self):
+        # a slow response within the deadline isn't cut short for the retries
+        self.start_server(delay=0.4)
+        core = load_module('wikipedia_enrich_core.py')
+        session = core.requests_retry_session()
+        self.assertEqual(core.get_json_request(session, self.url, core.Deadline(1.5)), {'success': 1})
+        self.assertEqual(self.server.requests, 1)
+
+    def test_no_retry_past_the_deadline(self):
+        # a try that times out at the deadline isn't made again
+        self.start_server(delay=1)
+        core = load_module('wikipedia_enrich_core.py')
+        session = core.requests_retry_session()
+        start = time.monotonic()
+        with self.assertRaises(core.requests.exceptions.RequestException):
+            core.get_json_request(session, self.url + '&slow=1', core.Deadline(0.3))
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_throttled_request(self):
+        # a throttled request slows down the host's rate limiter and is tried
+        # again by get_json_request rather than by the session
+        self.start_server(retry_after='0.1')
+        core = load_module('wikipedia_enrich_core.py')
+        session = core.requests_retry_session(backoff_factor=0)
+        self.assertEqual(core.get_json_request(session, self.url), {'success': 1})
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(core.metrics.get_stats()['counters'].get('http.throttled'), 1)
+        stats = core.get_rate_limiter_stats()['127.0.0.1:%d' % self.server.server_address[1]]
+        self.assertEqual(stats['throttle_events'], 1)
+        self.assertLess(stats['rate'], core.RATE_LIMIT_RATE)
+
+    def test_no_wait_past_the_deadline(self):
+        # a Retry-After that would go past the deadline fails the request
+        # right away rather than waiting for it
+        self.start_server(retry_after='3')
+        core = load_module('wikipedia_enrich_core.py')
+        session = core.requests_retry_session()
+        start = time.monotonic()
+        with self.assertRaises(core.DeadlineExceeded):
+            core.get_json_request(session, self.url + '&throttled=1', core.Deadline(1.0))
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_limits_are_shared_by_calls(self):
+        # calls made at the same time share the limit on the requests to a host
+        self.start_server(delay=0.3)
+        core = load_module('wikipedia_enrich_core.py')
+        core.HTTP_MAX_CONCURRENCY_PER_HOST = 2
+        core.RATE_LIMIT_RATE = core.RATE_LIMIT_MAX_RATE = 1000
+        session = core.requests_retry_session(backoff_factor=0)
+        def get_json_responses(call):
+            urls = [self.url + '&ids=Q%d%d' % (call, i) for i in range(4)]
+            core.get_json_responses(session, urls)
+        threads = [threading.Thread(target=get_json_responses, args=(call,)) for call in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.requests, 12)
+        self.assertEqual(self.server.max_active, 2)
+
+class RetryAfterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+
+    def get_retry_after(self, status_code, headers):
+        response = self.core.requests.models.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        return self.core.get_retry_after(response)
+
+    def test_retry_after(self):
+        # the Retry-After header can be in seconds or an http date, and
+        # throttled responses without one wait the default time
+        self.assertIsNone(self.get_retry_after(200, {}))
+        self.assertEqual(self.get_retry_after(429, {'Retry-After': '0.5'}), 0.5)
+        self.assertEqual(self.get_retry_after(503, {'Retry-After': 'Mon, 01 Jan 2001 00:00:00 GMT'}), 0.0)
+        self.assertEqual(self.get_retry_after(429, {}), self.core.RATE_LIMIT_RETRY_AFTER)
+        self.assertEqual(self.get_retry_after(200, {'MediaWiki-API-Error': 'maxlag', 'Retry-After': '5'}), 5.0)
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+
+    def test_throttle(self):
+        # the rate is cut in half once for the requests throttled together
+        # and the host is paused for the Retry-After time
+        rate_limiter = self.core.RateLimiter(10, 1, 50, 0.2)
+        rate_limiter.acquire()
+        rate_limiter.on_throttle(0.2)
+        rate_limiter.on_throttle(0.2)
+        stats = rate_limiter.get_stats()
+        self.assertEqual(stats['throttle_events'], 2)
+        self.assertEqual(stats['rate'], 5)
+        self.assertGreater(stats['paused_for'], 0.1)
+
+        # a request waits for the pause, unless it would go past the deadline
+        with self.assertRaises(self.core.DeadlineExceeded):
+            rate_limiter.acquire(self.core.Deadline(0.1))
+        start = time.monotonic()
+        rate_limiter.acquire()
+        self.assertGreater(time.monotonic() - start, 0.1)
+
+    def test_increase(self):
+        # each successful request grows the rate up to the maximum
+        rate_limiter = self.core.RateLimiter(10, 1, 10.5, 0.2)
+        rate_limiter.on_success()
+        self.assertAlmostEqual(rate_limiter.get_stats()['rate'], 10.2)
+        for i in range(5):
+            rate_limiter.on_success()
+        self.assertEqual(rate_limiter.get_stats()['rate'], 10.5)
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_extend(self):
+        # a batch gets more time for each row, unless there's no time limit
+        core = load_module('wikipedia_enrich_core.py')
+        deadline = core.Deadline(1)
+        deadline.extend(core.DEADLINE_PER_ROW * 30)
+        self.assertGreater(deadline.remaining(), 3.5)
+        deadline = core.Deadline(0)
+        deadline.extend(core.DEADLINE_PER_ROW * 30)
+        self.assertIsNone(deadline.remaining())
+
+if __name__ == '__main__':
+    unittest.main()
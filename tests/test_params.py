@@ -0,0 +1,28 @@
+# Tests for the parameters of the enrichment functions
+#
+# usage:
+#   python -m pytest tests
+
+import unittest
+
+from helpers import load_module
+
+class ToListTest(unittest.TestCase):
+
+    def test_to_list(self):
+        # lists of strings are kept whole and lists of lists are flattened
+        core = load_module('wikipedia_enrich_core.py')
+        self.assertEqual(core.to_list('en,de'), ['en', 'de'])
+        self.assertEqual(core.to_list(['en', 'de']), ['en', 'de'])
+        self.assertEqual(core.to_list([['en'], ['de']]), ['en', 'de'])
+        self.assertIsNone(core.to_list(None))
+
+    def test_language_list(self):
+        core = load_module('wikipedia_enrich_core.py')
+        validator = core.get_validator()
+        self.assertTrue(validator.validate({'search': 'JS Bach', 'properties': ['label', 'citizenship'], 'language': ['en', 'de']}))
+        self.assertEqual(validator.document['language'], ['en', 'de'])
+        self.assertEqual(validator.document['properties'], ['label', 'citizenship'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# Tests for the in-process search index of the people and org functions
+#
+# usage:
+#   python -m pytest tests
+
+import time
+import unittest
+
+from helpers import load_module
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+        self.index = self.core.SearchIndex(100, 2)
+
+    def test_lookup(self):
+        # the top item is only used when it's far enough ahead of the next one
+        self.index.add('en', 'Bach', 'Q1339', 10)
+        self.assertEqual(self.index.lookup('en', ' bach '), 'Q1339')
+        self.index.add('en', 'Bach', 'Q5', 6)
+        self.assertIsNone(self.index.lookup('en', 'Bach'))
+        self.assertIsNone(self.index.lookup('de', 'Bach'))
+
+    def test_expired_items(self):
+        # expired items are dropped so the search term goes through the cache
+        now = time.time()
+        self.index.add('en', 'Bach', 'Q1339', 10, now - 1)
+        self.assertIsNone(self.index.lookup('en', 'Bach'))
+        self.assertEqual(self.index.get_stats()['names'], 0)
+
+        self.index.add('en', 'Bach', 'Q1339', 10, now + 60)
+        self.index.add('en', 'Bach', 'Q5', 10, now - 1)
+        self.assertEqual(self.index.lookup('en', 'Bach'), 'Q1339')
+
+        # items without an expiry, from the entity store, are kept
+        self.index.add('en', 'Google', 'Q95', 10)
+        self.index.add('en', 'Google', 'Q95', 1, now - 1)
+        self.assertEqual(self.index.lookup('en', 'Google'), 'Q95')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Tests for the sharing of requests made at the same time by the enrichment
+# functions
+#
+# usage:
+#   python -m pytest tests
+
+import asyncio
+import threading
+import time
+import unittest
+
+from helpers import load_module
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+        self.single_flight = self.core.SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def tearDown(self):
+        self.release.set()
+
+    def get_result(self):
+        self.calls += 1
+        self.release.wait(5)
+        return {'success': 1}
+
+    def get_error(self):
+        self.calls += 1
+        self.release.wait(5)
+        raise ValueError('bad response')
+
+    def start(self, fn, results):
+        # make the first request on another thread and wait until it's in flight
+        def do():
+            try:
+                results.append(self.single_flight.do('key', fn))
+            except Exception as e:
+                results.append(e)
+        thread = threading.Thread(target=do, daemon=True)
+        thread.start()
+        while self.single_flight.get_stats()['in_flight'] == 0:
+            time.sleep(0.01)
+        return thread
+
+    def test_coalesced(self):
+        # a caller that makes the same request at the same time gets the result
+        # of the request that's in flight
+        results = []
+        thread = self.start(self.get_result, results)
+        waiter = threading.Thread(target=lambda: results.append(self.single_flight.do('key', self.get_result)))
+        waiter.start()
+        while self.single_flight.get_stats()['coalesced'] == 0:
+            time.sleep(0.01)
+        self.release.set()
+        thread.join()
+        waiter.join()
+        self.assertEqual(self.calls, 1)
+        self.assertIs(results[0], results[1])
+        self.assertEqual(self.single_flight.get_stats(), {'requests': 1, 'coalesced': 1, 'in_flight': 0})
+
+        # a request made afterwards isn't shared
+        self.assertEqual(self.single_flight.do('key', self.get_result), {'success': 1})
+        self.assertEqual(self.calls, 2)
+
+    def test_error(self):
+        # the callers waiting on a request that fails get its error
+        results = []
+        thread = self.start(self.get_error, results)
+        future, first = self.single_flight.join('key')
+        self.assertFalse(first)
+        self.release.set()
+        thread.join()
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIs(future.exception(), results[0])
+        self.assertEqual(self.calls, 1)
+
+    def test_waiter_deadline(self):
+        # a caller waits on the request in flight until its own deadline
+        results = []
+        self.start(self.get_result, results)
+        start = time.monotonic()
+        with self.assertRaises(self.core.DeadlineExceeded):
+            self.single_flight.do('key', self.get_result, deadline=self.core.Deadline(0.2))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.calls, 1)
+
+class AsyncSingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = load_module('wikipedia_enrich_core.py')
+        self.url = 'http://127.0.0.1:1/w/api.php?action=wbgetentities&ids=Q1'
+
+    def get_json_responses(self, deadline=None):
+        # the request in flight is waited on rather than made again, so the
+        # session isn't used
+        return asyncio.run(self.core.get_json_responses_async(None, [self.url], deadline))
+
+    def test_coalesced(self):
+        future, first = self.core.single_flight.join(self.core.normalize_url(self.url))
+        self.assertTrue(first)
+        threading.Timer(0.1, future.set_result, [{'success': 1}]).start()
+        self.assertEqual(self.get_json_responses(), [{'success': 1}])
+        self.assertEqual(self.core.get_single_flight_stats()['coalesced'], 1)
+
+    def test_error(self):
+        future, first = self.core.single_flight.join(self.core.normalize_url(self.url))
+        error = ValueError('bad response')
+        threading.Timer(0.1, future.set_exception, [error]).start()
+        self.assertEqual(self.get_json_responses(), [error])
+
+    def test_waiter_deadline(self):
+        self.core.single_flight.join(self.core.normalize_url(self.url))
+        start = time.monotonic()
+        responses = self.get_json_responses(self.core.Deadline(0.2))
+        self.assertIsInstance(responses[0], self.core.DeadlineExceeded)
+        self.assertLess(time.monotonic() - start, 1)
+
+if __name__ == '__main__':
+    unittest.main()
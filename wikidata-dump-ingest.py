@@ -0,0 +1,194 @@
+# Builds a local entity store from a Wikidata JSON dump so that the
+# wikipedia-enrich-people and wikipedia-enrich-org functions can run
+# without calling the Wikidata api; see the WIKIPEDIA_ENTITY_STORE_PATH
+# setting in those functions
+#
+# usage:
+#   python wikidata-dump-ingest.py latest-all.json.bz2 wikidata-store.sqlite --languages en,de
+#
+# the dumps are available here: https://dumps.wikimedia.org/wikidatawiki/entities/
+# and have one entity per line inside of a json array; the dump is streamed
+# one line at a time and only the parts of each entity used by the enrich
+# functions are kept
+
+import argparse
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import urllib.parse
+
+# the claims used by the enrich functions: the instance of (P31) claim and
+# the properties returned by get_claim_info in wikipedia-enrich-people.py
+# and wikipedia-enrich-org.py
+CLAIM_PROPS = [
+    'P31',
+    # people
+    'P21', 'P1477', 'P735', 'P734', 'P1559', 'P569', 'P570', 'P19', 'P20', 'P140', 'P27',
+    'P103', 'P22', 'P25', 'P26', 'P551', 'P106', 'P69', 'P2218',
+    # organizations
+    'P856', 'P1448', 'P1813', 'P1451', 'P571', 'P17',
+    # social media
+    'P2002', 'P3052', 'P4265', 'P2003'
+]
+
+# the json backend used to parse the dump; orjson is used when it's installed
+# unless WIKIPEDIA_JSON_BACKEND is set to 'json'
+JSON_BACKEND = os.environ.get('WIKIPEDIA_JSON_BACKEND', 'orjson')
+if JSON_BACKEND == 'orjson':
+    try:
+        import orjson
+    except ImportError:
+        JSON_BACKEND = 'json'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a local entity store from a Wikidata JSON dump')
+    parser.add_argument('dump_path', help='path to the dump (.json, .json.gz or .json.bz2)')
+    parser.add_argument('store_path', help='path to the store to create or add to')
+    parser.add_argument('--languages', default='en', help='comma-separated list of languages to keep (default: en)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of entities to write at a time')
+    args = parser.parse_args(argv)
+
+    languages = [l.strip() for l in args.languages.split(',') if l.strip()]
+    count = write_store(read_dump_entities(args.dump_path), args.store_path, languages, args.batch_size)
+    print('%d entities written to %s' % (count, args.store_path), file=sys.stderr)
+
+def read_dump_entities(dump_path):
+
+    # yield the entities in the dump one at a time; each line of the dump is
+    # an entity followed by a comma, except for the lines with the opening
+    # and closing brackets of the array
+    with open_dump(dump_path) as f:
+        for line in f:
+            line = line.strip()
+            if line in ('', '[', ']'):
+                continue
+            if line.endswith(','):
+                line = line[:-1]
+            yield loads_json(line)
+
+def loads_json(content):
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(content)
+    return json.loads(content)
+
+def open_dump(dump_path):
+    if dump_path.endswith('.bz2'):
+        return bz2.open(dump_path, 'rt', encoding='utf-8')
+    if dump_path.endswith('.gz'):
+        return gzip.open(dump_path, 'rt', encoding='utf-8')
+    return open(dump_path, 'r', encoding='utf-8')
+
+def write_store(entities, store_path, languages, batch_size=10000):
+
+    # write the entities to the store in batches; the store has the entities
+    # in the same form as the wbgetentities api returns them, keyed by id, and
+    # an index of the normalized labels and aliases of each entity ranked by
+    # the number of sitelinks of the entity
+    connection = sqlite3.connect(store_path)
+    connection.execute('create table if not exists entities (id text primary key, entity text)')
+    connection.execute('create table if not exists names (language text, name text, id text, weight integer)')
+
+    # the names of an entity are replaced when the entity is written again,
+    # so they're looked up by id as the store is written
+    connection.execute('create index if not exists names_id on names (id)')
+
+    count = 0
+    entity_rows = []
+    name_rows = []
+    for entity in entities:
+        if entity.get('type') != 'item' or 'id' not in entity:
+            continue
+
+        entity_rows.append((entity['id'], json.dumps(get_store_entity(entity, languages), separators=(',', ':'))))
+        name_rows.extend(get_store_names(entity, languages))
+        count += 1
+
+        if len(entity_rows) >= batch_size:
+            write_store_rows(connection, entity_rows, name_rows)
+            entity_rows = []
+            name_rows = []
+
+    write_store_rows(connection, entity_rows, name_rows)
+
+    # create the index after the names are written since it's faster than
+    # updating it with each batch
+    connection.execute('create index if not exists names_name on names (language, name, weight)')
+    connection.commit()
+    connection.close()
+    return count
+
+def write_store_rows(connection, entity_rows, name_rows):
+    entity_ids = [(r[0],) for r in entity_rows]
+    connection.executemany('delete from names where id = ?', entity_ids)
+    connection.executemany('insert or replace into entities (id, entity) values (?, ?)', entity_rows)
+    connection.executemany('insert into names (language, name, id, weight) values (?, ?, ?, ?)', name_rows)
+    connection.commit()
+
+def get_store_entity(entity, languages):
+
+    # keep the labels, descriptions and sitelinks for the languages and the
+    # value, rank and end time qualifier of the statements for the claims the
+    # enrich functions use
+    store_entity = {
+        'id': entity['id'],
+        'type': 'item',
+        'modified': entity.get('modified', ''),
+        'lastrevid': entity.get('lastrevid', 0),
+        'labels': {l: v for l, v in entity.get('labels', {}).items() if l in languages},
+        'descriptions': {l: v for l, v in entity.get('descriptions', {}).items() if l in languages},
+        'sitelinks': {},
+        'claims': {}
+    }
+
+    for language in languages:
+        sitelink = entity.get('sitelinks', {}).get(language + 'wiki')
+        if sitelink is None:
+            continue
+        title = sitelink.get('title', '')
+        store_entity['sitelinks'][language + 'wiki'] = {
+            'site': language + 'wiki',
+            'title': title,
+            'url': sitelink.get('url') or 'https://' + language + '.wikipedia.org/wiki/' + urllib.parse.quote(title.replace(' ', '_'))
+        }
+
+    for prop in CLAIM_PROPS:
+        statements = entity.get('claims', {}).get(prop, [])
+        if len(statements) == 0:
+            continue
+        store_entity['claims'][prop] = [get_store_statement(s) for s in statements]
+
+    return store_entity
+
+def get_store_statement(statement):
+    store_statement = {
+        'mainsnak': {'datavalue': statement.get('mainsnak', {}).get('datavalue', {})},
+        'rank': statement.get('rank', 'normal')
+    }
+    if 'P582' in statement.get('qualifiers', {}):
+        store_statement['qualifiers'] = {'P582': statement['qualifiers']['P582']}
+    return store_statement
+
+def get_store_names(entity, languages):
+
+    # the labels and aliases of the entity for the name index
+    weight = len(entity.get('sitelinks', {}))
+    names = set()
+    for language in languages:
+        label = entity.get('labels', {}).get(language, {}).get('value')
+        if label:
+            names.add((language, normalize_name(label)))
+        for alias in entity.get('aliases', {}).get(language, []):
+            if alias.get('value'):
+                names.add((language, normalize_name(alias['value'])))
+
+    return [(language, name, entity['id'], weight) for language, name in names if name != '']
+
+def normalize_name(name):
+    # the same normalization is used for search terms in the enrich functions
+    return ' '.join(name.lower().split())
+
+if __name__ == '__main__':
+    main()
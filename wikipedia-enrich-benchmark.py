@@ -0,0 +1,566 @@
+# Benchmarks the wikipedia enrichment functions against a local stand-in of
+# the Wikidata and Wikipedia apis so that runs are reproducible and don't
+# touch the production apis
+#
+# usage:
+#   python wikipedia-enrich-benchmark.py
+#   python wikipedia-enrich-benchmark.py --functions people --rows 2000 --latency 50 --throttle 0.02
+#   python wikipedia-enrich-benchmark.py --save baseline.json
+#   python wikipedia-enrich-benchmark.py --baseline baseline.json
+#
+# the stand-in serves the wbsearchentities, wbgetentities and extracts
+# responses from a set of fixtures with the given latency, and throttles
+# the given fraction of the requests with a 429 response; the fixtures are
+# generated from the --seed (entities shaped like the ones the apis return,
+# with references and unrelated claims) or loaded from a --fixtures file
+# with recorded responses in the same form as --write-fixtures writes
+#
+# each function is run over the same input in each mode:
+#   sequential: one call for each row
+#   batched: one call for each batch of rows, one request at a time
+#   async: one call for each batch of rows, with the requests made at the same time
+#   cached: the same as async, after a first run has filled the cache
+#   refresh: the same as cached, after the cache entries have expired and
+#     the --changes fraction of the entities have a new revision
+#
+# the report shows the rows per second, the p50/p95/p99 latency of the rows
+# (the time of the call a row was in), the requests and response bytes for
+# each row, the throttled requests, the rows returned partial when a
+# --deadline is set and the peak memory; with --baseline, the run fails if
+# the rows per second or the requests per row are worse than the baseline
+# by more than the --tolerance
+
+import argparse
+import http.server
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+FUNCTIONS = {
+    'people': 'wikipedia-enrich-people.py',
+    'org': 'wikipedia-enrich-org.py',
+    'description': 'wikipedia-enrich-description.py'
+}
+
+MODES = ['sequential', 'batched', 'async', 'cached', 'refresh']
+
+PROPERTIES = {
+    'people': 'label, description, birth_date, birth_place, citizenship, occupation',
+    'org': 'label, description, website, inception, country',
+    'description': None
+}
+
+LANGUAGES = ['en', 'de']
+
+GIVEN_NAMES = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Greta', 'Hugo', 'Ida', 'Jonas', 'Karl', 'Lena',
+               'Max', 'Nora', 'Otto', 'Paula', 'Quinn', 'Rosa', 'Simon', 'Tara', 'Uwe', 'Vera', 'Walter', 'Zoe']
+FAMILY_NAMES = ['Adler', 'Becker', 'Crane', 'Dorn', 'Eckert', 'Fischer', 'Graf', 'Hartmann', 'Imhof', 'Jung',
+                'Keller', 'Lorenz', 'Mayer', 'Neumann', 'Ortiz', 'Pohl', 'Quast', 'Richter', 'Sommer', 'Thiel',
+                'Ullrich', 'Vogel', 'Wagner', 'Young']
+ORG_WORDS = ['Acme', 'Apex', 'Blue', 'Cedar', 'Delta', 'Echo', 'Falcon', 'Granite', 'Harbor', 'Iron', 'Juniper',
+             'Kite', 'Lumen', 'Maple', 'Nova', 'Orbit', 'Pine', 'Quartz', 'River', 'Summit']
+ORG_SUFFIXES = ['Systems', 'Labs', 'Industries', 'Holdings', 'Foods', 'Motors', 'Media', 'Energy']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Wikipedia enrichment functions against a local stand-in of the apis')
+    parser.add_argument('--functions', default='people,org,description', help='comma-separated functions to run (default: people,org,description)')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated modes to run (default: %s)' % ','.join(MODES))
+    parser.add_argument('--rows', type=int, default=500, help='number of input rows for each function (default: 500)')
+    parser.add_argument('--batch-size', type=int, default=100, help='number of rows in each call in the batch modes (default: 100)')
+    parser.add_argument('--latency', type=float, default=20, help='latency of each api response in milliseconds (default: 20)')
+    parser.add_argument('--jitter', type=float, default=10, help='random extra latency of up to this many milliseconds (default: 10)')
+    parser.add_argument('--changes', type=float, default=0.05, help='fraction of the entities given a new revision in the refresh mode (default: 0.05)')
+    parser.add_argument('--throttle', type=float, default=0.0, help='fraction of the requests to throttle with a 429 response (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds of the throttled responses, a whole number as in the http spec (default: 1)')
+    parser.add_argument('--deadline', type=float, default=0, help='time budget of each call in seconds, plus WIKIPEDIA_DEADLINE_PER_ROW for each row (default: 0, no limit)')
+    parser.add_argument('--rate-limit', type=float, default=1000, help='requests per second the functions start at and may grow to (default: 1000)')
+    parser.add_argument('--misses', type=float, default=0.05, help='fraction of the input rows with no match (default: 0.05)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the fixtures and the input rows (default: 1)')
+    parser.add_argument('--fixtures', help='load the fixtures from this file instead of generating them')
+    parser.add_argument('--write-fixtures', help='write the fixtures to this file')
+    parser.add_argument('--process-pool', type=int, default=0, help='size of the process pool the people and org functions decode large responses in (default: 0, no pool)')
+    parser.add_argument('--trace-memory', action='store_true', help='report the peak python memory of each run with tracemalloc (slower)')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare the results with the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fraction a result may be worse than the baseline (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    if args.fixtures:
+        with open(args.fixtures, 'r', encoding='utf-8') as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = make_fixtures(args.rows, args.seed)
+    if args.write_fixtures:
+        with open(args.write_fixtures, 'w', encoding='utf-8') as f:
+            json.dump(fixtures, f)
+
+    server = MockServer(fixtures, args.latency / 1000.0, args.jitter / 1000.0, args.throttle, args.retry_after, args.seed)
+    server.start()
+    try:
+        results = []
+        for function_name in [f.strip() for f in args.functions.split(',') if f.strip()]:
+            rows = make_rows(fixtures, function_name, args.rows, args.misses, args.seed)
+            for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+                if mode in ('cached', 'refresh') and function_name == 'description':
+                    continue
+                results.append(run_mode(function_name, mode, rows, server, args))
+                print_result(results[-1])
+    finally:
+        server.stop()
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = get_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+def run_mode(function_name, mode, rows, server, args):
+
+    # run the function over the rows in the mode, with its own copy of the
+    # function so that nothing in memory is shared with the other runs
+    cache_dir = tempfile.mkdtemp()
+    try:
+        function = load_function(function_name, mode)
+        configure_function(function, mode, server, args, os.path.join(cache_dir, 'cache.sqlite'))
+        batches = [[row] for row in rows] if mode == 'sequential' else [rows[idx:idx+args.batch_size] for idx in range(0, len(rows), args.batch_size)]
+        if mode in ('cached', 'refresh'):
+            for batch in batches:
+                call_function(function, function_name, batch, mode)
+        if mode == 'refresh':
+            expire_cache(function)
+            server.change_entities(args.changes)
+
+        server.reset()
+        partial_rows = get_partial_rows(function)
+        if args.trace_memory:
+            tracemalloc.start()
+        latencies = []
+        start = time.perf_counter()
+        for batch in batches:
+            batch_start = time.perf_counter()
+            call_function(function, function_name, batch, mode)
+            latencies.extend([time.perf_counter() - batch_start] * len(batch))
+        elapsed = time.perf_counter() - start
+        partial_rows = get_partial_rows(function) - partial_rows
+        peak_memory = None
+        if args.trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    requests = server.get_requests()
+    return {
+        'function': function_name,
+        'mode': mode,
+        'rows': len(rows),
+        'rows_per_sec': len(rows) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': get_percentile(latencies, 50) * 1000,
+        'p95_ms': get_percentile(latencies, 95) * 1000,
+        'p99_ms': get_percentile(latencies, 99) * 1000,
+        'requests_per_row': requests['total'] / float(len(rows)),
+        'bytes_per_row': requests.get('bytes', 0) / float(len(rows)),
+        'requests': requests,
+        'partial_rows': partial_rows,
+        'peak_memory': peak_memory if peak_memory is not None else get_peak_rss()
+    }
+
+def configure_function(function, mode, server, args, cache_path):
+
+    # point the function at the stand-in; the settings are read when the
+    # function is loaded, so they're set on the loaded function and the
+    # copy of the core module it was loaded with
+    core = function.core
+    core.WIKIDATA_API_URL = server.url + '/wikidata/w/api.php'
+    function.WIKIPEDIA_API_URL = server.url + '/{language}/w/api.php'
+    core.CACHE_PATH = cache_path if mode in ('cached', 'refresh') else ''
+    core.RATE_LIMIT_RATE = args.rate_limit
+    core.DEADLINE = args.deadline
+    core.PROCESS_POOL_SIZE = args.process_pool
+    core.RATE_LIMIT_MAX_RATE = max(core.RATE_LIMIT_MAX_RATE, args.rate_limit)
+    if mode == 'batched':
+        core.HTTP_MAX_CONCURRENCY = 1
+        core.HTTP_MAX_CONCURRENCY_PER_HOST = 1
+
+def get_partial_rows(function):
+    return function.get_stats().get('counters', {}).get('rows.partial', 0)
+
+def expire_cache(function):
+
+    # expire the cache entries as if they were cached more than the ttl ago,
+    # past the time they're used while stale
+    connection = function.core.get_cache_connection()
+    with function.core.cache_lock:
+        connection.execute('update cache set expires = ?', [time.time() - function.core.CACHE_STALE_TTL - 1])
+        connection.commit()
+
+def call_function(function, function_name, batch, mode):
+    if mode == 'sequential':
+        params = [batch[0]] if function_name == 'description' else [batch[0], PROPERTIES[function_name]]
+    else:
+        params = [[[row] for row in batch]] if function_name == 'description' else [[[row] for row in batch], PROPERTIES[function_name]]
+    flex = Flex(params)
+    function.flexio_handler(flex)
+    return flex.output.value
+
+def load_function(function_name, mode):
+
+    # load a fresh copy of the function along with a fresh copy of the core
+    # module the functions share
+    sys.modules.pop('wikipedia_enrich_core', None)
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), FUNCTIONS[function_name])
+    spec = importlib.util.spec_from_file_location('benchmark_%s_%s' % (function_name, mode), path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def get_percentile(values, percentile):
+    # nearest-rank percentile
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(percentile / 100.0 * len(values) + 0.5)) - 1))]
+
+def get_peak_rss():
+    # peak resident set size of the process (in kilobytes on linux); this
+    # only grows, so with several runs it's the peak of the runs so far
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+def print_result(result):
+    print('%-12s %-10s %6d rows %9.1f rows/s  p50 %8.1f ms  p95 %8.1f ms  p99 %8.1f ms  %6.2f requests/row  %8.1f KB/row  %4d throttled  %4d partial  peak memory %s' % (
+        result['function'], result['mode'], result['rows'], result['rows_per_sec'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+        result['requests_per_row'], result.get('bytes_per_row', 0) / 1024.0, result['requests'].get('throttled', 0), result.get('partial_rows', 0), result['peak_memory']))
+    sys.stdout.flush()
+
+def get_regressions(results, baseline, tolerance):
+    baseline_results = {(r['function'], r['mode']): r for r in baseline}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get((result['function'], result['mode']))
+        if baseline_result is None:
+            continue
+        name = '%s %s' % (result['function'], result['mode'])
+        if result['rows_per_sec'] < baseline_result['rows_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.1f rows/s (baseline %.1f)' % (name, result['rows_per_sec'], baseline_result['rows_per_sec']))
+        if result['requests_per_row'] > baseline_result['requests_per_row'] * (1 + tolerance):
+            regressions.append('%s: %.2f requests/row (baseline %.2f)' % (name, result['requests_per_row'], baseline_result['requests_per_row']))
+    return regressions
+
+class FlexInput(object):
+    def __init__(self, value):
+        self.value = value
+    def read(self):
+        return self.value
+
+class FlexOutput(object):
+    def __init__(self):
+        self.content_type = None
+        self.value = None
+    def write(self, value):
+        self.value = value
+
+class Flex(object):
+
+    # stands in for the flex object the functions are called with
+    def __init__(self, params):
+        self.input = FlexInput(json.dumps(params))
+        self.output = FlexOutput()
+
+def make_rows(fixtures, function_name, count, misses, seed):
+
+    # the input rows: names of the people or organizations (or either, for
+    # the descriptions), with the more common names repeated more often, as
+    # in a real list, and some names with no match
+    rng = random.Random('%s-%s' % (seed, function_name))
+    names = fixtures['names'][function_name] if function_name in fixtures['names'] else fixtures['names']['people'] + fixtures['names']['org']
+    weights = [1.0 / (idx + 1) ** 0.8 for idx in range(len(names))]
+    rows = []
+    for idx in range(count):
+        if rng.random() < misses:
+            rows.append('Nobody %d' % rng.randint(0, 1000000))
+        else:
+            rows.append(rng.choices(names, weights)[0])
+    return rows
+
+def make_fixtures(count, seed):
+
+    # entities shaped like the ones the apis return: labels, descriptions and
+    # sitelinks in each language, and claims with references and qualifiers,
+    # along with unrelated claims as a well-linked entity has; some names are
+    # shared by an item of another type that comes first in the search
+    rng = random.Random(seed)
+    fixtures = {'entities': {}, 'searches': {}, 'pages': {}, 'names': {'people': [], 'org': []}}
+    next_id = [100]
+
+    def add_entity(label, description, claims):
+        qid = 'Q%d' % next_id[0]
+        next_id[0] += 1
+        fixtures['entities'][qid] = {
+            'id': qid,
+            'type': 'item',
+            'modified': '2020-01-01T00:00:00Z',
+            'lastrevid': rng.randint(1000000, 2000000000),
+            'labels': {l: {'language': l, 'value': label} for l in LANGUAGES},
+            'descriptions': {l: {'language': l, 'value': description if l == 'en' else description + ' (' + l + ')'} for l in LANGUAGES},
+            'aliases': {},
+            'sitelinks': {l + 'wiki': {'site': l + 'wiki', 'title': label, 'badges': []} for l in LANGUAGES},
+            'claims': claims
+        }
+        fixtures['searches'].setdefault(normalize_name(label), []).append(qid)
+        fixtures['pages'][normalize_name(label)] = [next_id[0], '%s is a %s.' % (label, description)]
+        return qid
+
+    def statement(prop, datavalue, rank='normal', qualifiers=None):
+        return {
+            'mainsnak': {'snaktype': 'value', 'property': prop, 'datavalue': datavalue},
+            'type': 'statement',
+            'id': '%s$%08x' % (prop, rng.getrandbits(32)),
+            'rank': rank,
+            'qualifiers': qualifiers or {},
+            'references': [{
+                'hash': '%040x' % rng.getrandbits(160),
+                'snaks': {
+                    'P248': [{'snaktype': 'value', 'property': 'P248', 'datavalue': item('Q36578')}],
+                    'P813': [{'snaktype': 'value', 'property': 'P813', 'datavalue': date('+2019-06-01T00:00:00Z')}]
+                },
+                'snaks-order': ['P248', 'P813']
+            }]
+        }
+
+    def item(qid):
+        return {'type': 'wikibase-entityid', 'value': {'entity-type': 'item', 'id': qid, 'numeric-id': int(qid[1:])}}
+
+    def date(value):
+        return {'type': 'time', 'value': {'time': value, 'timezone': 0, 'before': 0, 'after': 0, 'precision': 11, 'calendarmodel': 'http://www.wikidata.org/entity/Q1985727'}}
+
+    def string(value):
+        return {'type': 'string', 'value': value}
+
+    def other_claims():
+        return {'P%d' % (5000 + idx): [statement('P%d' % (5000 + idx), string('value %d' % rng.randint(0, 1000000)))] for idx in rng.sample(range(500), rng.randint(20, 60))}
+
+    countries = [add_entity('Country %d' % idx, 'country', {}) for idx in range(30)]
+    cities = [add_entity('City %d' % idx, 'city', {'P17': [statement('P17', item(rng.choice(countries)))]}) for idx in range(60)]
+    occupations = [add_entity('Occupation %d' % idx, 'occupation', {}) for idx in range(40)]
+    genders = [add_entity('male', 'sex or gender', {}), add_entity('female', 'sex or gender', {})]
+    other_classes = [add_entity('film', 'work of art', {}), add_entity('album', 'music release', {})]
+
+    for idx in range(max(count // 2, 50)):
+        name = '%s %s' % (rng.choice(GIVEN_NAMES), rng.choice(FAMILY_NAMES))
+        if name in fixtures['names']['people']:
+            name = '%s %s %s' % (rng.choice(GIVEN_NAMES), rng.choice(GIVEN_NAMES)[0] + '.', rng.choice(FAMILY_NAMES))
+        if rng.random() < 0.1:
+            add_entity(name, 'work', {'P31': [statement('P31', item(rng.choice(other_classes)))]})
+        claims = {
+            'P31': [statement('P31', item('Q5'))],
+            'P21': [statement('P21', item(rng.choice(genders)))],
+            'P27': [statement('P27', item(rng.choice(countries)))],
+            'P106': [statement('P106', item(o)) for o in rng.sample(occupations, rng.randint(1, 3))],
+            'P569': [statement('P569', date('+%04d-%02d-%02dT00:00:00Z' % (rng.randint(1850, 2000), rng.randint(1, 12), rng.randint(1, 28))))],
+            'P19': [statement('P19', item(rng.choice(cities)))]
+        }
+        if rng.random() < 0.2:
+            claims['P27'].insert(0, statement('P27', item(rng.choice(countries)), qualifiers={'P582': [{'snaktype': 'value', 'property': 'P582', 'datavalue': date('+1990-01-01T00:00:00Z')}]}))
+        claims.update(other_claims())
+        add_entity(name, 'person', claims)
+        fixtures['names']['people'].append(name)
+
+    for idx in range(max(count // 2, 50)):
+        name = '%s %s' % (rng.choice(ORG_WORDS), rng.choice(ORG_SUFFIXES))
+        if name in fixtures['names']['org']:
+            name = '%s %s %s' % (rng.choice(ORG_WORDS), rng.choice(ORG_WORDS), rng.choice(ORG_SUFFIXES))
+        if rng.random() < 0.1:
+            add_entity(name, 'work', {'P31': [statement('P31', item(rng.choice(other_classes)))]})
+        claims = {
+            'P31': [statement('P31', item(rng.choice(['Q4830453', 'Q891723', 'Q783794'])))],
+            'P17': [statement('P17', item(rng.choice(countries)))],
+            'P571': [statement('P571', date('+%04d-01-01T00:00:00Z' % rng.randint(1850, 2015)))],
+            'P856': [statement('P856', string('https://www.%s.example.com' % normalize_name(name).replace(' ', '')))]
+        }
+        claims.update(other_claims())
+        add_entity(name, 'company', claims)
+        fixtures['names']['org'].append(name)
+
+    return fixtures
+
+def normalize_name(name):
+    return ' '.join(name.lower().split())
+
+class MockServer(object):
+
+    # local stand-in for the wikidata and wikipedia apis; the wikidata api is
+    # served at /wikidata/w/api.php and each wikipedia at /<language>/w/api.php
+
+    def __init__(self, fixtures, latency, jitter, throttle, retry_after, seed):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.server = None
+        self.url = None
+
+    def start(self):
+        mock_server = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            # the headers and the body are written separately, so on a
+            # reused connection Nagle's algorithm holds back the body until
+            # the client acknowledges the headers
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, headers, body = mock_server.handle(self.path)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                # clients close the connection when they give up on a
+                # request (e.g. when their deadline passes)
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        self.server = Server(('127.0.0.1', 0), RequestHandler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+
+    def get_requests(self):
+        with self.lock:
+            requests = dict(self.requests)
+        requests['total'] = sum(v for k, v in requests.items() if k not in ('throttled', 'bytes'))
+        return requests
+
+    def count(self, kind, value=1):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + value
+
+    def change_entities(self, fraction):
+
+        # give a new revision to the fraction of the entities
+        with self.lock:
+            for entity in self.fixtures['entities'].values():
+                if self.random.random() < fraction:
+                    entity['lastrevid'] += 1
+                    entity['modified'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    def handle(self, path):
+        with self.lock:
+            delay = self.latency + self.random.random() * self.jitter
+            throttled = self.random.random() < self.throttle
+        time.sleep(delay)
+
+        parts = urllib.parse.urlsplit(path)
+        params = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+        if throttled:
+            self.count('throttled')
+            return 429, {'Retry-After': str(self.retry_after), 'Content-Type': 'text/plain'}, b'Too Many Requests'
+
+        site = parts.path.strip('/').split('/')[0]
+        if site == 'wikidata' and params.get('action') == 'wbsearchentities':
+            self.count('wbsearchentities')
+            body = self.get_search_entities(params)
+        elif site == 'wikidata' and params.get('action') == 'wbgetentities':
+            self.count('wbgetentities')
+            body = self.get_entities(params)
+        elif site != 'wikidata' and params.get('action') == 'query' and params.get('generator') == 'search':
+            self.count('search_extracts')
+            body = self.get_search_extracts(params)
+        elif site != 'wikidata' and params.get('action') == 'query' and params.get('prop') == 'extracts':
+            self.count('extracts')
+            body = self.get_extracts(params)
+        else:
+            self.count('unknown')
+            return 400, {'Content-Type': 'text/plain'}, b'Unknown request'
+        body = json.dumps(body).encode('utf-8')
+        self.count('bytes', len(body))
+        return 200, {'Content-Type': 'application/json; charset=utf-8'}, body
+
+    def get_search_entities(self, params):
+        ids = self.fixtures['searches'].get(normalize_name(params.get('search', '')), [])[:int(params.get('limit', 7))]
+        return {'search': [{'id': i, 'label': self.fixtures['entities'][i]['labels'].get('en', {}).get('value', '')} for i in ids], 'success': 1}
+
+    def get_entities(self, params):
+        props = params.get('props', 'info|sitelinks|aliases|labels|descriptions|claims|datatype').split('|')
+        languages = params['languages'].split('|') if params.get('languages') else None
+        sites = params['sitefilter'].split('|') if params.get('sitefilter') else None
+        entities = {}
+        for item_id in params.get('ids', '').split('|')[:50]:
+            entity = self.fixtures['entities'].get(item_id)
+            if entity is None:
+                entities[item_id] = {'id': item_id, 'missing': ''}
+                continue
+            result = {'id': item_id, 'type': entity['type']}
+            if 'info' in props:
+                result['modified'] = entity['modified']
+                result['lastrevid'] = entity['lastrevid']
+            for k in ('labels', 'descriptions', 'aliases'):
+                if k in props:
+                    result[k] = {l: v for l, v in entity.get(k, {}).items() if languages is None or l in languages}
+            if 'claims' in props:
+                result['claims'] = entity.get('claims', {})
+            if 'sitelinks' in props or 'sitelinks/urls' in props:
+                result['sitelinks'] = {}
+                for site, sitelink in entity.get('sitelinks', {}).items():
+                    if sites is not None and site not in sites:
+                        continue
+                    sitelink = dict(sitelink)
+                    if 'sitelinks/urls' in props:
+                        sitelink['url'] = 'https://%s.wikipedia.org/wiki/%s' % (site[:-4], urllib.parse.quote(sitelink['title'].replace(' ', '_')))
+                    result['sitelinks'][site] = sitelink
+            entities[item_id] = result
+        return {'entities': entities, 'success': 1}
+
+    def get_search_extracts(self, params):
+        page = self.fixtures['pages'].get(normalize_name(params.get('gsrsearch', '')))
+        if page is None:
+            return {'batchcomplete': ''}
+        return {'batchcomplete': '', 'query': {'pages': {str(page[0]): {'pageid': page[0], 'ns': 0, 'index': 1, 'extract': page[1]}}}}
+
+    def get_extracts(self, params):
+        extracts = {str(page[0]): page[1] for page in self.fixtures['pages'].values()}
+        page_ids = params.get('pageids', '').split('|')
+        return {'batchcomplete': '', 'query': {'pages': {i: {'pageid': int(i), 'ns': 0, 'extract': extracts.get(i, '')} for i in page_ids}}}
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+# Runs the wikipedia enrichment functions over a CSV or NDJSON file from
+# the command line; the input is streamed in batches through the function's
+# batch mode with a limited number of batches in flight, so memory use
+# doesn't grow with the size of the input
+#
+# usage:
+#   python wikipedia-enrich-cli.py people names.csv enriched.csv --column name --properties "label, description, birth_date"
+#   python wikipedia-enrich-cli.py org companies.ndjson enriched.ndjson --properties "*" --unordered
+#   python wikipedia-enrich-cli.py description topics.csv described.csv --resume
+#   python wikipedia-enrich-cli.py people names.csv enriched.csv --properties "label, description" --language en,de
+#
+# CSV input has a header row and the search terms are taken from the
+# --column column (the first column by default); NDJSON input has either a
+# string on each line or an object with the search term in the --column key
+# ("search" by default) and, optionally, its own "properties" as a
+# comma-separated string or a list of property names; with more than
+# one --language, each property is written once for each language in a
+# column named property:language (e.g. label:de)
+#
+# output rows are written in input order as the batches finish, or with
+# --unordered, as soon as each batch finishes; either way each output row
+# starts with the number of its input row; progress is saved to a checkpoint
+# file after each batch so that --resume continues an interrupted run
+# (with --unordered, rows finished after the last checkpoint may be written
+# again on resume and can be told apart by their row number)
+
+import argparse
+import concurrent.futures
+import csv
+import importlib.util
+import json
+import os
+import sys
+from collections import deque
+
+FUNCTIONS = {
+    'people': 'wikipedia-enrich-people.py',
+    'org': 'wikipedia-enrich-org.py',
+    'description': 'wikipedia-enrich-description.py'
+}
+
+class FlexInput(object):
+    def __init__(self, value):
+        self.value = value
+    def read(self):
+        return self.value
+
+class FlexOutput(object):
+    def __init__(self):
+        self.content_type = None
+        self.value = None
+    def write(self, value):
+        self.value = value
+
+class Flex(object):
+
+    # stands in for the flex object the functions are called with
+    def __init__(self, params):
+        self.input = FlexInput(json.dumps(params))
+        self.output = FlexOutput()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Enrich a CSV or NDJSON file with information from Wikipedia')
+    parser.add_argument('function', choices=sorted(FUNCTIONS.keys()), help='the enrichment function to run')
+    parser.add_argument('input_path', help='the CSV or NDJSON file to enrich')
+    parser.add_argument('output_path', help='the file to write the enriched rows to')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='the input and output format (default: from the input file extension)')
+    parser.add_argument('--column', help='the column (CSV) or key (NDJSON) with the search terms')
+    parser.add_argument('--properties', default='description', help='comma-separated properties to return (default: description)')
+    parser.add_argument('--language', default='en', help='comma-separated languages of the values to return (default: en)')
+    parser.add_argument('--batch-size', type=int, default=200, help='number of rows enriched in each call (default: 200)')
+    parser.add_argument('--in-flight', type=int, default=4, help='number of batches enriched at the same time (default: 4)')
+    parser.add_argument('--unordered', action='store_true', help='write the rows as soon as their batch finishes')
+    parser.add_argument('--deadline', type=float, default=0, help='time budget of each batch in seconds, plus WIKIPEDIA_DEADLINE_PER_ROW for each row; rows not enriched in time are returned partial (default: 0, no limit)')
+    parser.add_argument('--checkpoint', help='the checkpoint file (default: the output path with a .checkpoint extension)')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of an interrupted run')
+    args = parser.parse_args(argv)
+
+    input_format = args.format or ('ndjson' if os.path.splitext(args.input_path)[1].lower() in ('.ndjson', '.jsonl') else 'csv')
+    checkpoint_path = args.checkpoint or args.output_path + '.checkpoint'
+    function = load_function(args.function)
+    function.core.DEADLINE = args.deadline
+
+    # get the columns of the output rows
+    properties = ['description'] if args.function == 'description' else [p.strip().lower() for p in args.properties.split(',') if p.strip()]
+    if properties == ['*']:
+        properties = get_function_returns(FUNCTIONS[args.function])
+    languages = [l.strip().lower() for l in args.language.split(',') if l.strip()] or ['en']
+
+    skip_rows = read_checkpoint(checkpoint_path) if args.resume else 0
+    with open(args.input_path, 'r', encoding='utf-8', newline='') as input_file, \
+         open(args.output_path, 'a' if skip_rows > 0 else 'w', encoding='utf-8', newline='') as output_file:
+        rows = read_rows(input_file, input_format, args.column)
+        writer = RowWriter(output_file, input_format, properties, languages, write_header=(skip_rows == 0))
+        count = enrich_file(function, args.function, rows, writer, properties, languages, checkpoint_path, skip_rows,
+                            args.batch_size, args.in_flight, args.unordered)
+
+    print('%d rows written to %s' % (count, args.output_path), file=sys.stderr)
+
+def enrich_file(function, function_name, rows, writer, properties, languages, checkpoint_path, skip_rows, batch_size, in_flight, unordered):
+
+    # enrich the rows in batches with at most in_flight batches at a time;
+    # the checkpoint is the number of input rows from the start of the input
+    # that have been written
+    count = 0
+    pending = deque()
+    finished = set()
+    checkpoint = skip_rows
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=in_flight) as executor:
+        for batch in get_batches(rows, batch_size, skip_rows):
+            if len(pending) >= in_flight:
+                count += write_batches(pending, finished, writer, unordered)
+                checkpoint = write_checkpoint(checkpoint_path, pending, finished, checkpoint)
+            pending.append((batch, executor.submit(enrich_batch, function, function_name, batch, properties, languages)))
+
+        while len(pending) > 0:
+            count += write_batches(pending, finished, writer, unordered)
+            checkpoint = write_checkpoint(checkpoint_path, pending, finished, checkpoint)
+
+    return count
+
+def write_batches(pending, finished, writer, unordered):
+
+    # write the next batch in input order or, when unordered, every batch
+    # that has finished; returns the number of rows written
+    count = 0
+    if not unordered:
+        batch, future = pending[0]
+        writer.write(batch, future.result())
+        finished.add(id(future))
+        return len(batch)
+
+    futures = [future for batch, future in pending if id(future) not in finished]
+    done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+    for batch, future in pending:
+        if future in done:
+            writer.write(batch, future.result())
+            finished.add(id(future))
+            count += len(batch)
+    return count
+
+def write_checkpoint(checkpoint_path, pending, finished, checkpoint):
+
+    # remove the batches from the front of the queue that have been written
+    # and save the row after the last of them
+    while len(pending) > 0 and id(pending[0][1]) in finished:
+        batch, future = pending.popleft()
+        finished.discard(id(future))
+        checkpoint = batch[-1]['row']
+
+    checkpoint_tmp_path = checkpoint_path + '.tmp'
+    with open(checkpoint_tmp_path, 'w') as f:
+        json.dump({'rows': checkpoint}, f)
+    os.replace(checkpoint_tmp_path, checkpoint_path)
+    return checkpoint
+
+def read_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, 'r') as f:
+            return int(json.load(f).get('rows', 0))
+    except (OSError, ValueError):
+        return 0
+
+def enrich_batch(function, function_name, batch, properties, languages):
+
+    # call the function with the batch; if the function fails, the rows in
+    # the batch are returned empty so the other batches can carry on
+    if function_name == 'description':
+        params = [[row['search'] for row in batch], ','.join(languages)]
+    else:
+        params = [[[row['search'], row['properties'] or ','.join(properties)] for row in batch], ','.join(properties), ','.join(languages)]
+
+    flex = Flex(params)
+    try:
+        function.flexio_handler(flex)
+    except Exception as e:
+        print('rows %d-%d failed: %r' % (batch[0]['row'], batch[-1]['row'], e), file=sys.stderr)
+        return [[] for row in batch]
+
+    result = flex.output.value
+    return json.loads(result) if isinstance(result, str) else result
+
+def get_batches(rows, batch_size, skip_rows):
+    batch = []
+    for row in rows:
+        if row['row'] <= skip_rows:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def read_rows(input_file, input_format, column):
+
+    # yield the rows of the input numbered from 1
+    if input_format == 'csv':
+        reader = csv.reader(input_file)
+        header = next(reader, [])
+        column_idx = header.index(column) if column else 0
+        for row_number, values in enumerate(reader, 1):
+            yield {'row': row_number, 'search': values[column_idx] if column_idx < len(values) else '', 'properties': None}
+        return
+
+    for row_number, line in enumerate(input_file, 1):
+        line = line.strip()
+        value = json.loads(line) if line != '' else ''
+        if isinstance(value, dict):
+            # the properties of a row are passed on as a comma-separated string
+            properties = value.get('properties')
+            if isinstance(properties, list):
+                properties = ','.join(str(p) for p in properties)
+            yield {'row': row_number, 'search': str(value.get(column or 'search') or ''), 'properties': properties}
+        else:
+            yield {'row': row_number, 'search': str(value), 'properties': None}
+
+class RowWriter(object):
+
+    # writes the enriched rows as CSV or NDJSON
+
+    def __init__(self, output_file, output_format, properties, languages, write_header):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.properties = properties
+        self.languages = languages
+        if output_format == 'csv':
+            self.writer = csv.writer(output_file)
+            if write_header:
+                self.writer.writerow(['row', 'search'] + self.get_columns(properties))
+
+    def get_columns(self, properties):
+        if len(self.languages) <= 1:
+            return properties
+        return ['%s:%s' % (p, l) for p in properties for l in self.languages]
+
+    def write(self, batch, result):
+        for row, values in zip(batch, result):
+            if self.output_format == 'csv':
+                self.writer.writerow([row['row'], row['search']] + list(values))
+                continue
+            properties = self.properties
+            if row['properties']:
+                properties = [p.strip().lower() for p in row['properties'].split(',')]
+            output_row = {'row': row['row'], 'search': row['search']}
+            output_row.update(zip(self.get_columns(properties), values))
+            self.output_file.write(json.dumps(output_row) + '\n')
+        self.output_file.flush()
+
+def load_function(function_name):
+
+    # the functions are standalone scripts, so load them by path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), FUNCTIONS[function_name])
+    spec = importlib.util.spec_from_file_location(FUNCTIONS[function_name][:-3].replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def get_function_returns(function_file):
+
+    # the names of the values a function returns, from the returns section
+    # of the function's header
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), function_file)
+    names = []
+    in_returns = False
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            if not line.startswith('#'):
+                break
+            if line.startswith('# returns:'):
+                in_returns = True
+            elif line.startswith('# ') and not line.startswith('#  '):
+                in_returns = False
+            elif in_returns and line.startswith('#   - name:'):
+                names.append(line.split('name:', 1)[1].strip())
+    return names
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,12 @@
 # params:
 #   - name: search
 #     type: string
-#     description: Text search of Wikipedia
+#     description: Text search of Wikipedia; may also be a list of search terms to look up in a single call
 #     required: true
+#   - name: language
+#     type: array
+#     description: The language of the Wikipedia to search (defaults to 'en'); may also be a list of languages, in which case a description is returned for each language
+#     required: false
 # returns:
 #   - name: description
 #     type: string
@@ -19,19 +23,29 @@
 # ---
 
 import json
-import urllib
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+import logging
 from cerberus import Validator
 from collections import OrderedDict
-from bs4 import BeautifulSoup
+import os
+import threading
+import urllib
+import wikipedia_enrich_core as core
 
-def flexio_handler(flex):
+# the api endpoint for each language; this can point at a mirror or a local
+# stand-in of the api (e.g. the one in wikipedia-enrich-benchmark.py)
+WIKIPEDIA_API_URL = os.environ.get('WIKIPEDIA_API_URL', 'https://{language}.wikipedia.org/w/api.php')
 
-    # TODO: support language
-    language = 'en'
+# the requests, their time limits, the metrics and the other settings are
+# shared with the people and org functions in wikipedia_enrich_core
+logger = logging.getLogger('wikipedia-enrich-description')
 
+validator = None
+validator_lock = threading.Lock()
+
+def flexio_handler(flex):
+
+    # the call's time budget starts now
+    deadline = core.Deadline(core.DEADLINE)
 
     # get the input
     input = flex.input.read()
@@ -41,67 +55,166 @@ def flexio_handler(flex):
     except ValueError:
         raise ValueError
 
-    # define the expected parameters and map the values to the parameter names
-    # based on the positions of the keys/values
-    params = OrderedDict()
-    params['search'] = {'required': True, 'type': 'string'}
-    input = dict(zip(params.keys(), input))
-
-    # validate the mapped input against the validator
+    # map the values to the parameter names based on the positions of the
+    # keys/values and validate the mapped input against the validator
     # if the input is valid return an error
-    v = Validator(params, allow_unknown = True)
-    input = v.validated(input)
+    v = get_validator()
+    with validator_lock:
+        input = dict(zip(v.schema.keys(), input))
+        input = v.validated(input)
     if input is None:
         raise ValueError
 
-    # see here for more info: https://en.wikipedia.org/w/api.php?action=help&modules=query
-    # see here to experiment with the api: https://en.wikipedia.org/wiki/Special:ApiSandbox
+    # get the search terms to look up; a single search term is looked up as
+    # a batch with one row so that both input forms share the same lookups,
+    # and the call's time budget grows with the rows in each language
+    rows = get_input_rows(input['search'])
+    languages = core.get_languages(input['language'])
+    deadline.extend(core.DEADLINE_PER_ROW * len(rows) * len(languages))
 
-    # STEP 1: perform a search and get the page id for the top item in the search
-    url_query_params = {'action': 'query', 'format': 'json', 'list': 'search', 'srprop': 'timestamp', 'srsearch': input['search']}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://en.wikipedia.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    search_info = response.json()
-    search_items = search_info.get('query', {}).get('search', [])
-
-    top_search_item = {}
-    if len(search_items) > 0:
-        top_search_item = search_items[0]
-
-    top_search_item_page_id = top_search_item.get('pageid')
-    if top_search_item_page_id is None:
-        flex.output.content_type = "application/json"
-        flex.output.write([[""]])
-        return
-
-    # STEP 2: get the article for the page id returned by the search
-    top_search_item_page_id = str(top_search_item_page_id)
-    url = 'https://en.wikipedia.org/w/api.php?format=json&action=query&prop=extracts&explaintext=&exintro=&exsentences=1&pageids=' + top_search_item_page_id
-    response = requests_retry_session().get(url)
-    article_info = response.json()
-    extract = article_info.get('query',{}).get('pages',{}).get(top_search_item_page_id, {}).get('extract', '')
-
-    result = [[extract]]
+    # build up the result; each language has its own wikipedia, so the rows
+    # are described in each language separately
+    results = [describe_rows(rows, language, deadline) for language in languages]
+    result = [[value for language_row in language_rows for value in language_row] for language_rows in zip(*results)]
+
+    # return the results
     flex.output.content_type = "application/json"
     flex.output.write(result)
 
-def requests_retry_session(
-    retries=3,
-    backoff_factor=0.3,
-    status_forcelist=(429, 500, 502, 503, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+def describe_rows(rows, language, deadline=None):
+
+    # see here for more info: https://en.wikipedia.org/w/api.php?action=help&modules=query
+    # see here to experiment with the api: https://en.wikipedia.org/wiki/Special:ApiSandbox
+
+    # use the shared session for all the requests in the batch; the requests
+    # are made within the call's deadline and the rows whose search or
+    # article couldn't be looked up in time are returned empty
+    session = core.get_session()
+    if deadline is None:
+        deadline = core.Deadline(core.DEADLINE)
+        deadline.extend(core.DEADLINE_PER_ROW * len(rows))
+    timer = core.StageTimer(core.metrics)
+    core.metrics.incr('rows', len(rows))
+
+    # STEP 1: perform a search and get the article for the top item in the search
+    # in the same request; repeated search terms are only searched once and the
+    # searches for the rows are made at the same time
+    searches = list(OrderedDict.fromkeys(search for search in rows if search != ''))
+    search_page_ids, page_extracts = get_search_page_extracts(session, searches, language, deadline)
+    timer.mark('search')
+
+    # STEP 2: get the article for any page the search didn't return an article
+    # for (e.g. when the api cut the response short); the pages are packed
+    # together into as few requests as possible
+    page_ids = list(OrderedDict.fromkeys(page_id for page_id in search_page_ids.values() if page_id is not None and page_id not in page_extracts))
+    page_extracts.update(get_page_extracts(session, page_ids, language, deadline))
+    timer.mark('extracts')
+
+    # rows whose search failed or whose article couldn't be fetched are partial
+    partial_count = len([search for search in rows if search != '' and (search not in search_page_ids or
+                         (search_page_ids[search] is not None and search_page_ids[search] not in page_extracts))])
+    if partial_count > 0:
+        core.metrics.incr('rows.partial', partial_count)
+        logger.warning('%d of %d rows are partial%s', partial_count, len(rows), ' (deadline exceeded)' if deadline.expired() else '')
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for row_number, search in enumerate(rows, 1):
+            page_id = search_page_ids.get(search)
+            logger.debug('row %d: search %r, language %s, page %s, %s', row_number, search, language, page_id,
+                         'no page' if page_id is None else 'extract fetched' if page_id in page_ids else 'extract from search')
+    timer.finish()
+
+    return [[page_extracts.get(search_page_ids.get(search), '')] for search in rows]
+
+def get_input_rows(search):
+
+    # a batch is a list of search terms (e.g. a column of cells)
+    if isinstance(search, str):
+        search = [search]
+
+    rows = []
+    for item in search:
+        if isinstance(item, list):
+            item = item[0] if len(item) > 0 else ''
+        if item is None:
+            item = ''
+        if isinstance(item, (list, dict)):
+            raise ValueError
+        rows.append(str(item).strip())
+
+    return rows
+
+def get_search_page_extracts(session, searches, language, deadline=None):
+
+    # use the search as a generator for the extracts query so that the page
+    # for the top item in the search and its article come back together;
+    # search terms whose search fails are left out
+    urls = []
+    for search in searches:
+        url_query_params = {'action': 'query', 'format': 'json', 'generator': 'search', 'gsrsearch': search, 'gsrlimit': 1, 'gsrprop': '',
+                            'prop': 'extracts', 'explaintext': '', 'exintro': '', 'exsentences': 1}
+        url_query_str = urllib.parse.urlencode(url_query_params)
+        urls.append(WIKIPEDIA_API_URL.format(language=language) + '?' + url_query_str)
+
+    search_page_ids = {}
+    page_extracts = {}
+    for search, search_info in zip(searches, core.get_json_responses(session, urls, deadline)):
+        if isinstance(search_info, Exception):
+            continue
+        search_items = list(search_info.get('query', {}).get('pages', {}).values())
+        search_items = sorted(search_items, key=lambda i: i.get('index', 0))
+
+        top_search_item = {}
+        if len(search_items) > 0:
+            top_search_item = search_items[0]
+
+        top_search_item_page_id = top_search_item.get('pageid')
+        if top_search_item_page_id is None:
+            search_page_ids[search] = None
+            continue
+
+        top_search_item_page_id = str(top_search_item_page_id)
+        search_page_ids[search] = top_search_item_page_id
+        if 'extract' in top_search_item:
+            page_extracts[top_search_item_page_id] = top_search_item['extract']
+
+    return search_page_ids, page_extracts
+
+def get_page_extracts(session, page_ids, language, deadline=None, max_ids=20):
+
+    # the api returns at most 20 intro extracts per request, so pack the page
+    # ids into groups of 20
+    page_id_groups = [page_ids[idx:idx+max_ids] for idx in range(0, len(page_ids), max_ids)]
+    urls = []
+    for page_id_group in page_id_groups:
+        url_query_params = {'action': 'query', 'format': 'json', 'prop': 'extracts', 'explaintext': '', 'exintro': '', 'exsentences': 1,
+                            'exlimit': 'max', 'pageids': '|'.join(page_id_group)}
+        url_query_str = urllib.parse.urlencode(url_query_params)
+        urls.append(WIKIPEDIA_API_URL.format(language=language) + '?' + url_query_str)
+
+    page_extracts = {}
+    for page_id_group, article_info in zip(page_id_groups, core.get_json_responses(session, urls, deadline)):
+        if isinstance(article_info, Exception):
+            continue
+        for page_id in page_id_group:
+            page_extracts[page_id] = article_info.get('query',{}).get('pages',{}).get(page_id, {}).get('extract', '')
+
+    return page_extracts
+
+def get_validator():
+
+    # define the expected parameters the first time they're needed; the
+    # validator keeps the document it's validating, so it's used by one
+    # call at a time
+    global validator
+    with validator_lock:
+        if validator is None:
+            params = OrderedDict()
+            params['search'] = {'required': True, 'type': ['string', 'list']}
+            params['language'] = {'required': False, 'validator': core.validator_list, 'coerce': core.to_list, 'default': 'en'}
+            validator = Validator(params, allow_unknown = True)
+        return validator
+
+def get_stats():
+    # the statistics of the shared code
+    return core.get_stats()
@@ -7,12 +7,16 @@
 # params:
 #   - name: search
 #     type: string
-#     description: Text search of Wikipedia
+#     description: Text search of Wikipedia; may also be a list of search terms, or a list of [search, properties] rows, to enrich in a single call
 #     required: true
 #   - name: properties
 #     type: array
 #     description: The properties to return (defaults to 'description'). See "Returns" for a listing of the available properties.
 #     required: false
+#   - name: language
+#     type: array
+#     description: The language of the values to return (defaults to 'en'); may also be a list of languages, in which case each property is returned once for each language
+#     required: false
 # returns:
 #   - name: label
 #     type: string
@@ -56,230 +60,123 @@
 #   - name: updated_dt
 #     type: string
 #     description: The date the information was last updated
+#   - name: partial
+#     type: string
+#     description: 'true' when some of the information couldn't be looked up in time and the values are incomplete
 # examples:
 #   - '"Google"'
 #   - '"Apple"'
 # ---
 
-import json
-import urllib
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-import itertools
-from datetime import *
-from decimal import *
-from cerberus import Validator
+import logging
 from collections import OrderedDict
+import wikipedia_enrich_core as core
+
+# the classes an item found by a search should be an instance of (P31);
+# when the top search result isn't, the first of the top search results
+# that is gets used instead; the classes are the common subclasses of
+# organization (Q43229) so that the check doesn't need a lookup of the
+# class hierarchy
+ITEM_CLASSES = {
+    'Q43229',    # organization
+    'Q4830453',  # business
+    'Q783794',   # company
+    'Q891723',   # public company
+    'Q1589009',  # privately held company
+    'Q6881511',  # enterprise
+    'Q167037',   # corporation
+    'Q161726',   # multinational corporation
+    'Q219577',   # holding company
+    'Q658255',   # subsidiary
+    'Q18388277', # technology company
+    'Q1058914',  # software company
+    'Q786820',   # automobile manufacturer
+    'Q210167',   # video game developer
+    'Q1762059',  # film production company
+    'Q1331793',  # media company
+    'Q2085381',  # publisher
+    'Q11032',    # newspaper
+    'Q15265344', # broadcaster
+    'Q18127',    # record label
+    'Q22687',    # bank
+    'Q46970',    # airline
+    'Q507619',   # retail chain
+    'Q163740',   # nonprofit organization
+    'Q79913',    # non-governmental organization
+    'Q157031',   # foundation
+    'Q48204',    # voluntary association
+    'Q484652',   # international organization
+    'Q245065',   # intergovernmental organization
+    'Q327333',   # government agency
+    'Q2659904',  # government organization
+    'Q7278',     # political party
+    'Q7210356',  # political organization
+    'Q1530022',  # religious organization
+    'Q3918',     # university
+    'Q38723',    # higher education institution
+    'Q2385804',  # educational institution
+    'Q4671277',  # academic institution
+    'Q31855',    # research institute
+    'Q1664720',  # institute
+    'Q33506',    # museum
+    'Q16917',    # hospital
+    'Q847017',   # sports club
+    'Q476028',   # association football club
+    'Q12973014'  # sports team
+}
+
+# the properties that can be returned, in the order they're returned for '*'
+DEFAULT_PROPERTIES = OrderedDict()
+DEFAULT_PROPERTIES['label'] = ''
+DEFAULT_PROPERTIES['description'] = ''
+DEFAULT_PROPERTIES['wikipedia_url'] = ''
+DEFAULT_PROPERTIES['website'] = ''
+DEFAULT_PROPERTIES['official_name'] = ''
+DEFAULT_PROPERTIES['short_name'] = ''
+DEFAULT_PROPERTIES['motto'] = ''
+DEFAULT_PROPERTIES['inception'] = ''
+DEFAULT_PROPERTIES['country'] = ''
+DEFAULT_PROPERTIES['twitter_id'] = ''
+DEFAULT_PROPERTIES['instagram_id'] = ''
+DEFAULT_PROPERTIES['reddit_id'] = ''
+DEFAULT_PROPERTIES['bloomberg_id'] = ''
+DEFAULT_PROPERTIES['updated_dt'] = ''
+DEFAULT_PROPERTIES['partial'] = ''
+
+# the claims returned for each item; each entry maps a returned property to
+# the wikidata property it comes from along with the type of its value
+# (an item, whose label is returned, or a time, quantity, monolingualtext or
+# string) and which of the property's statements are used:
+#   first: the first statement, whatever its rank
+#   preferred: the best ranked statement (the default)
+#   joined: the best ranked statements joined with the separator (', ' by default)
+#   all: the best ranked statements as a list
+# deprecated statements are left out and the preferred statements, if there
+# are any, are used instead of the normal ones; with current, statements with
+# an end time (P582) qualifier are left out as well
+CLAIM_PROPERTIES = [
+    #{'name': 'logo_url', 'prop': 'P154', 'type': 'string'},
+    {'name': 'website', 'prop': 'P856', 'type': 'string', 'current': True},
+    {'name': 'official_name', 'prop': 'P1448', 'type': 'monolingualtext', 'current': True},
+    {'name': 'short_name', 'prop': 'P1813', 'type': 'monolingualtext'},
+    {'name': 'motto', 'prop': 'P1451', 'type': 'monolingualtext', 'current': True},
+    {'name': 'inception', 'prop': 'P571', 'type': 'time'},
+    {'name': 'country', 'prop': 'P17', 'type': 'item', 'current': True},
+    #{'name': 'stock_ticker', 'prop': 'P414', 'type': 'item', 'values': 'joined'},
+    {'name': 'twitter_id', 'prop': 'P2002', 'type': 'string'},
+    {'name': 'bloomberg_id', 'prop': 'P3052', 'type': 'string'},
+    {'name': 'reddit_id', 'prop': 'P4265', 'type': 'string'},
+    {'name': 'instagram_id', 'prop': 'P2003', 'type': 'string'}
+]
+
+# the rows are enriched by the code the people and org functions share in
+# wikipedia_enrich_core; its settings (e.g. core.DEADLINE) apply to every
+# function loaded in the process
+enricher = core.EntityEnricher('org', ITEM_CLASSES, DEFAULT_PROPERTIES, CLAIM_PROPERTIES, logging.getLogger('wikipedia-enrich-org'))
 
 def flexio_handler(flex):
+    enricher.flexio_handler(flex)
 
-    # TODO: support language
-    language = 'en'
-
-
-    # get the input
-    input = flex.input.read()
-    try:
-        input = json.loads(input)
-        if not isinstance(input, list): raise ValueError
-    except ValueError:
-        raise ValueError
-
-    # define the expected parameters and map the values to the parameter names
-    # based on the positions of the keys/values
-    params = OrderedDict()
-    params['search'] = {'required': True, 'type': 'string'}
-    params['properties'] = {'required': False, 'validator': validator_list, 'coerce': to_list, 'default': 'description'}
-    input = dict(zip(params.keys(), input))
-
-    # validate the mapped input against the validator
-    # if the input is valid return an error
-    v = Validator(params, allow_unknown = True)
-    input = v.validated(input)
-    if input is None:
-        raise ValueError
-
-    # default property list
-    default_properties = OrderedDict()
-    default_properties['label'] = ''
-    default_properties['description'] = ''
-    default_properties['wikipedia_url'] = ''
-    default_properties['website'] = ''
-    default_properties['official_name'] = ''
-    default_properties['short_name'] = ''
-    default_properties['motto'] = ''
-    default_properties['inception'] = ''
-    default_properties['country'] = ''
-    default_properties['twitter_id'] = ''
-    default_properties['instagram_id'] = ''
-    default_properties['reddit_id'] = ''
-    default_properties['bloomberg_id'] = ''
-    default_properties['updated_dt'] = ''
-
-    # see here for general information about the wikidata api: https://www.wikidata.org/wiki/Wikidata:Data_access
-    # see here for list of sorted properties: https://www.wikidata.org/wiki/MediaWiki:Wikibase-SortedProperties
-
-    # STEP 1: make an initial search request to find the most relevant item
-    # https://www.wikidata.org/w/api.php?action=wbsearchentities&language=en&search=:search_term
-    url_query_params = {'action': 'wbsearchentities', 'language': language, 'format': 'json', 'search': input['search']}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    search_info = response.json()
-    search_items = search_info.get('search', [])
-
-    if len(search_items) == 0:
-        flex.output.content_type = "application/json"
-        flex.output.write([[""]])
-        return
-
-    search_first_item_id = search_items[0].get('id','')
-
-    # STEP 2: get the info about the item
-    # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
-    props = 'info|sitelinks|sitelinks/urls|labels|descriptions|claims|datatype'
-    url_query_params = {'action': 'wbgetentities', 'sites': 'enwiki', 'props': props, 'format': 'json', 'ids': search_first_item_id}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    content = response.json()
-
-    # TODO:
-    # confirm we have an organization
-
-    # STEP 3: get primary item info and additional info
-    item_primary_info = get_basic_info(content, search_first_item_id, language)
-    item_claim_info = get_claim_info(content, search_first_item_id, language)
-
-    # STEP 4: make an additional lookup to find out the info from the wikipedia entity values
-    # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
-    props = 'labels'
-    search_ids = [i.get('datavalue',{}).get('value',{}).get('id','') for i in item_claim_info if i.get('datavalue',{}).get('type') == 'wikibase-entityid']
-    search_ids = '|'.join(search_ids)
-    url_query_params = {'action': 'wbgetentities', 'sites': 'enwiki', 'props': props, 'format': 'json', 'ids': search_ids}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    content = response.json()
-
-    # STEP 5: use the info from the additional lookup to populate the values in the item info
-    item_claim_info_enriched = [update_claim_info(i, content, language) for i in item_claim_info]
-
-    # STEP 6: merge the primary info and the enriched info
-    item_info_lookup = {}
-    for i in item_primary_info:
-        item_info_lookup[i['name']] = i.get('value','')
-    for i in item_claim_info:
-        item_info_lookup[i['name']] = i.get('value','')
-
-    # get the properties to return
-    properties = [p.lower().strip() for p in input['properties']]
-
-    # if we have a wildcard, get all the properties
-    if len(properties) == 1 and properties[0] == '*':
-        properties = list(default_properties.keys())
-
-    # build up the result
-    result = [[item_info_lookup.get(p,'') or '' for p in properties]]
-
-    # return the results
-    result = json.dumps(result, default=to_string)
-    flex.output.content_type = "application/json"
-    flex.output.write(result)
-
-def update_claim_info(claim_info, object, language):
-    value_type = claim_info.get('datavalue',{}).get('type')
-    if value_type == 'wikibase-entityid':
-        entity_id_lookup = claim_info.get('datavalue',{}).get('value',{}).get('id','')
-        claim_info['value'] = object.get('entities',{}).get(entity_id_lookup,{}).get('labels',{}).get(language, {}).get('value','')
-    if value_type == 'time':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('time','')
-    if value_type == 'quantity':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('amount','')
-    if value_type == 'monolingualtext':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('text','')
-    if value_type == 'string':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value','')
-    return claim_info
-
-def get_basic_info(object, item_id, language):
-    return [
-        {'name': 'label', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('labels',{}).get(language, {}).get('value','')},
-        {'name': 'description', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('descriptions',{}).get(language, {}).get('value','')},
-        {'name': 'updated_dt', 'type': 'datetime', 'value': object.get('entities',{}).get(item_id,{}).get('modified','')},
-        {'name': 'wikipedia_url', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('sitelinks',{}).get(language+'wiki',{}).get('url','')}
-    ]
-
-def get_claim_info(object, item_id, language):
-
-    properties = [
-        #{'name': 'logo_url', 'prop': 'P154'},
-        {'name': 'website', 'prop': 'P856'},
-        {'name': 'official_name', 'prop': 'P1448'},
-        {'name': 'short_name', 'prop': 'P1813'},
-        {'name': 'motto', 'prop': 'P1451'},
-        {'name': 'inception', 'prop': 'P571'},
-        {'name': 'country', 'prop': 'P17'},
-        #{'name': 'stock_ticker', 'prop': 'P414'},
-        {'name': 'twitter_id', 'prop': 'P2002'},
-        {'name': 'bloomberg_id', 'prop': 'P3052'},
-        {'name': 'reddit_id', 'prop': 'P4265'},
-        {'name': 'instagram_id', 'prop': 'P2003'}
-    ]
-
-    updated_properties = [{
-        'name': p['name'],
-        'prop': p['prop'],
-        'datavalue': object.get('entities',{}).get(item_id,{}).get('claims').get(p['prop'],[{}])[0].get('mainsnak',{}).get('datavalue',{})
-    } for p in properties]
-
-    return updated_properties
-
-def requests_retry_session(
-    retries=3,
-    backoff_factor=0.3,
-    status_forcelist=(429, 500, 502, 503, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
-def validator_list(field, value, error):
-    if isinstance(value, str):
-        return
-    if isinstance(value, list):
-        for item in value:
-            if not isinstance(item, str):
-                error(field, 'Must be a list with only string values')
-        return
-    error(field, 'Must be a string or a list of strings')
-
-def to_string(value):
-    if isinstance(value, (date, datetime)):
-        return value.isoformat()
-    if isinstance(value, (Decimal)):
-        return str(value)
-    return value
-
-def to_list(value):
-    # if we have a list of strings, create a list from them; if we have
-    # a list of lists, flatten it into a single list of strings
-    if isinstance(value, str):
-        return value.split(",")
-    if isinstance(value, list):
-        return list(itertools.chain.from_iterable(value))
-    return None
+def get_stats():
+    # the function's statistics along with those of the shared code
+    return enricher.get_stats()
@@ -7,12 +7,16 @@
 # params:
 #   - name: search
 #     type: string
-#     description: Text search of Wikipedia
+#     description: Text search of Wikipedia; may also be a list of search terms, or a list of [search, properties] rows, to enrich in a single call
 #     required: true
 #   - name: properties
 #     type: array
 #     description: The properties to return (defaults to 'description'). See "Returns" for a listing of the available properties.
 #     required: false
+#   - name: language
+#     type: array
+#     description: The language of the values to return (defaults to 'en'); may also be a list of languages, in which case each property is returned once for each language
+#     required: false
 # returns:
 #   - name: label
 #     type: string
@@ -95,256 +99,103 @@
 #   - name: updated_dt
 #     type: string
 #     description: The date the information was last updated
+#   - name: partial
+#     type: string
+#     description: 'true' when some of the information couldn't be looked up in time and the values are incomplete
 # examples:
 #   - '"Teddy Roosevelt"'
 #   - '"JS Bach"'
 # ---
 
-import json
-import urllib
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-import itertools
-from datetime import *
-from decimal import *
-from cerberus import Validator
+import logging
 from collections import OrderedDict
+import wikipedia_enrich_core as core
+
+# the classes an item found by a search should be an instance of (P31);
+# when the top search result isn't, the first of the top search results
+# that is gets used instead
+ITEM_CLASSES = {
+    'Q5' # human
+}
+
+# the properties that can be returned, in the order they're returned for '*'
+DEFAULT_PROPERTIES = OrderedDict()
+DEFAULT_PROPERTIES['label'] = ''
+DEFAULT_PROPERTIES['description'] = ''
+DEFAULT_PROPERTIES['wikipedia_url'] = ''
+DEFAULT_PROPERTIES['gender'] = ''
+DEFAULT_PROPERTIES['birth_name'] = ''
+DEFAULT_PROPERTIES['given_name'] = ''
+DEFAULT_PROPERTIES['family_name'] = ''
+DEFAULT_PROPERTIES['native_name'] = ''
+DEFAULT_PROPERTIES['birth_date'] = ''
+DEFAULT_PROPERTIES['death_date'] = ''
+DEFAULT_PROPERTIES['birth_place'] = ''
+DEFAULT_PROPERTIES['death_place'] = ''
+DEFAULT_PROPERTIES['religion'] = ''
+DEFAULT_PROPERTIES['citizenship'] = ''
+DEFAULT_PROPERTIES['native_language'] = ''
+DEFAULT_PROPERTIES['father'] = ''
+DEFAULT_PROPERTIES['mother'] = ''
+DEFAULT_PROPERTIES['spouse'] = ''
+DEFAULT_PROPERTIES['residence'] = ''
+DEFAULT_PROPERTIES['occupation'] = ''
+DEFAULT_PROPERTIES['education'] = ''
+DEFAULT_PROPERTIES['net_worth'] = ''
+DEFAULT_PROPERTIES['twitter_id'] = ''
+DEFAULT_PROPERTIES['instagram_id'] = ''
+DEFAULT_PROPERTIES['reddit_id'] = ''
+DEFAULT_PROPERTIES['bloomberg_id'] = ''
+DEFAULT_PROPERTIES['updated_dt'] = ''
+DEFAULT_PROPERTIES['partial'] = ''
+
+# the claims returned for each item; each entry maps a returned property to
+# the wikidata property it comes from along with the type of its value
+# (an item, whose label is returned, or a time, quantity, monolingualtext or
+# string) and which of the property's statements are used:
+#   first: the first statement, whatever its rank
+#   preferred: the best ranked statement (the default)
+#   joined: the best ranked statements joined with the separator (', ' by default)
+#   all: the best ranked statements as a list
+# deprecated statements are left out and the preferred statements, if there
+# are any, are used instead of the normal ones; with current, statements with
+# an end time (P582) qualifier are left out as well
+CLAIM_PROPERTIES = [
+    {'name': 'gender', 'prop': 'P21', 'type': 'item'},
+    {'name': 'birth_name', 'prop': 'P1477', 'type': 'monolingualtext'},
+    {'name': 'given_name', 'prop': 'P735', 'type': 'item', 'values': 'joined', 'separator': ' '},
+    {'name': 'family_name', 'prop': 'P734', 'type': 'item'},
+    {'name': 'native_name', 'prop': 'P1559', 'type': 'monolingualtext'},
+    {'name': 'birth_date', 'prop': 'P569', 'type': 'time'},
+    {'name': 'death_date', 'prop': 'P570', 'type': 'time'},
+    {'name': 'birth_place', 'prop': 'P19', 'type': 'item'},
+    {'name': 'death_place', 'prop': 'P20', 'type': 'item'},
+    {'name': 'religion', 'prop': 'P140', 'type': 'item'},
+    {'name': 'citizenship', 'prop': 'P27', 'type': 'item', 'values': 'joined', 'current': True},
+    {'name': 'native_language', 'prop': 'P103', 'type': 'item'},
+    {'name': 'father', 'prop': 'P22', 'type': 'item'},
+    {'name': 'mother', 'prop': 'P25', 'type': 'item'},
+    {'name': 'spouse', 'prop': 'P26', 'type': 'item', 'values': 'joined'},
+    #{'name': 'children', 'prop': 'P40', 'type': 'item', 'values': 'joined'},
+    #{'name': 'children_count', 'prop': 'P1971', 'type': 'quantity'},
+    {'name': 'residence', 'prop': 'P551', 'type': 'item', 'values': 'joined', 'current': True},
+    {'name': 'occupation', 'prop': 'P106', 'type': 'item', 'values': 'joined'},
+    {'name': 'education', 'prop': 'P69', 'type': 'item', 'values': 'joined'},
+    {'name': 'net_worth', 'prop': 'P2218', 'type': 'quantity'},
+    {'name': 'twitter_id', 'prop': 'P2002', 'type': 'string'},
+    {'name': 'bloomberg_id', 'prop': 'P3052', 'type': 'string'},
+    {'name': 'reddit_id', 'prop': 'P4265', 'type': 'string'},
+    {'name': 'instagram_id', 'prop': 'P2003', 'type': 'string'}
+]
+
+# the rows are enriched by the code the people and org functions share in
+# wikipedia_enrich_core; its settings (e.g. core.DEADLINE) apply to every
+# function loaded in the process
+enricher = core.EntityEnricher('people', ITEM_CLASSES, DEFAULT_PROPERTIES, CLAIM_PROPERTIES, logging.getLogger('wikipedia-enrich-people'))
 
 def flexio_handler(flex):
+    enricher.flexio_handler(flex)
 
-    # TODO: support language
-    language = 'en'
-
-
-    # get the input
-    input = flex.input.read()
-    try:
-        input = json.loads(input)
-        if not isinstance(input, list): raise ValueError
-    except ValueError:
-        raise ValueError
-
-    # define the expected parameters and map the values to the parameter names
-    # based on the positions of the keys/values
-    params = OrderedDict()
-    params['search'] = {'required': True, 'type': 'string'}
-    params['properties'] = {'required': False, 'validator': validator_list, 'coerce': to_list, 'default': 'description'}
-    input = dict(zip(params.keys(), input))
-
-    # validate the mapped input against the validator
-    # if the input is valid return an error
-    v = Validator(params, allow_unknown = True)
-    input = v.validated(input)
-    if input is None:
-        raise ValueError
-
-    default_properties = OrderedDict()
-    default_properties['label'] = ''
-    default_properties['description'] = ''
-    default_properties['wikipedia_url'] = ''
-    default_properties['gender'] = ''
-    default_properties['birth_name'] = ''
-    default_properties['given_name'] = ''
-    default_properties['family_name'] = ''
-    default_properties['native_name'] = ''
-    default_properties['birth_date'] = ''
-    default_properties['death_date'] = ''
-    default_properties['birth_place'] = ''
-    default_properties['death_place'] = ''
-    default_properties['religion'] = ''
-    default_properties['citizenship'] = ''
-    default_properties['native_language'] = ''
-    default_properties['father'] = ''
-    default_properties['mother'] = ''
-    default_properties['spouse'] = ''
-    default_properties['residence'] = ''
-    default_properties['occupation'] = ''
-    default_properties['education'] = ''
-    default_properties['net_worth'] = ''
-    default_properties['twitter_id'] = ''
-    default_properties['instagram_id'] = ''
-    default_properties['reddit_id'] = ''
-    default_properties['bloomberg_id'] = ''
-    default_properties['updated_dt'] = ''
-
-    # see here for general information about the wikidata api: https://www.wikidata.org/wiki/Wikidata:Data_access
-    # see here for list of sorted properties: https://www.wikidata.org/wiki/MediaWiki:Wikibase-SortedProperties
-
-    # STEP 1: make an initial search request to find the most relevant item
-    # https://www.wikidata.org/w/api.php?action=wbsearchentities&language=en&search=:search_term
-    url_query_params = {'action': 'wbsearchentities', 'language': language, 'format': 'json', 'search': input['search']}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    search_info = response.json()
-    search_items = search_info.get('search', [])
-
-    if len(search_items) == 0:
-        flex.output.content_type = "application/json"
-        flex.output.write([[""]])
-        return
-
-    search_first_item_id = search_items[0].get('id','')
-
-    # STEP 2: get the info about the item
-    # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
-    props = 'info|sitelinks|sitelinks/urls|labels|descriptions|claims|datatype'
-    url_query_params = {'action': 'wbgetentities', 'sites': 'enwiki', 'props': props, 'format': 'json', 'ids': search_first_item_id}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    content = response.json()
-
-    # TODO:
-    # confirm we have a human
-    # instanceof (P31) is Q5 (human)
-
-    # STEP 3: get primary item info and additional info
-    item_primary_info = get_basic_info(content, search_first_item_id, language)
-    item_claim_info = get_claim_info(content, search_first_item_id, language)
-
-    # STEP 4: make an additional lookup to find out the info from the wikipedia entity values
-    # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
-    props = 'labels'
-    search_ids = [i.get('datavalue',{}).get('value',{}).get('id','') for i in item_claim_info if i.get('datavalue',{}).get('type') == 'wikibase-entityid']
-    search_ids = '|'.join(search_ids)
-    url_query_params = {'action': 'wbgetentities', 'sites': 'enwiki', 'props': props, 'format': 'json', 'ids': search_ids}
-    url_query_str = urllib.parse.urlencode(url_query_params)
-
-    url = 'https://www.wikidata.org/w/api.php?' + url_query_str
-    response = requests_retry_session().get(url)
-    content = response.json()
-
-    # STEP 5: use the info from the additional lookup to populate the values in the item info
-    item_claim_info_enriched = [update_claim_info(i, content, language) for i in item_claim_info]
-
-    # STEP 6: merge the primary info and the enriched info
-    item_info_lookup = {}
-    for i in item_primary_info:
-        item_info_lookup[i['name']] = i.get('value','')
-    for i in item_claim_info:
-        item_info_lookup[i['name']] = i.get('value','')
-
-    # get the properties to return
-    properties = [p.lower().strip() for p in input['properties']]
-
-    # if we have a wildcard, get all the properties
-    if len(properties) == 1 and properties[0] == '*':
-        properties = list(default_properties.keys())
-
-    # build up the result
-    result = [[item_info_lookup.get(p,'') or '' for p in properties]]
-
-    # return the results
-    result = json.dumps(result, default=to_string)
-    flex.output.content_type = "application/json"
-    flex.output.write(result)
-
-def update_claim_info(claim_info, object, language):
-    value_type = claim_info.get('datavalue',{}).get('type')
-    if value_type == 'wikibase-entityid':
-        entity_id_lookup = claim_info.get('datavalue',{}).get('value',{}).get('id','')
-        claim_info['value'] = object.get('entities',{}).get(entity_id_lookup,{}).get('labels',{}).get(language, {}).get('value','')
-    if value_type == 'time':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('time','')
-    if value_type == 'quantity':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('amount','')
-    if value_type == 'monolingualtext':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value',{}).get('text','')
-    if value_type == 'string':
-        claim_info['value'] = claim_info.get('datavalue',{}).get('value','')
-    return claim_info
-
-def get_basic_info(object, item_id, language):
-    return [
-        {'name': 'label', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('labels',{}).get(language, {}).get('value','')},
-        {'name': 'description', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('descriptions',{}).get(language, {}).get('value','')},
-        {'name': 'updated_dt', 'type': 'datetime', 'value': object.get('entities',{}).get(item_id,{}).get('modified','')},
-        {'name': 'wikipedia_url', 'type': 'string', 'value': object.get('entities',{}).get(item_id,{}).get('sitelinks',{}).get(language+'wiki',{}).get('url','')}
-    ]
-
-def get_claim_info(object, item_id, language):
-
-    properties = [
-        {'name': 'gender', 'prop': 'P21'},
-        {'name': 'birth_name', 'prop': 'P1477'},
-        {'name': 'given_name', 'prop': 'P735'},
-        {'name': 'family_name', 'prop': 'P734'},
-        {'name': 'native_name', 'prop': 'P1559'},
-        {'name': 'birth_date', 'prop': 'P569'},
-        {'name': 'death_date', 'prop': 'P570'},
-        {'name': 'birth_place', 'prop': 'P19'},
-        {'name': 'death_place', 'prop': 'P20'},
-        {'name': 'religion', 'prop': 'P140'},
-        {'name': 'citizenship', 'prop': 'P27'},
-        {'name': 'native_language', 'prop': 'P103'},
-        {'name': 'father', 'prop': 'P22'},
-        {'name': 'mother', 'prop': 'P25'},
-        {'name': 'spouse', 'prop': 'P26'},
-        #{'name': 'children', 'prop': 'P40'},
-        #{'name': 'children_count', 'prop': 'P1971'},
-        {'name': 'residence', 'prop': 'P551'},
-        {'name': 'occupation', 'prop': 'P106'},
-        {'name': 'education', 'prop': 'P69'},
-        {'name': 'net_worth', 'prop': 'P2218'},
-        {'name': 'twitter_id', 'prop': 'P2002'},
-        {'name': 'bloomberg_id', 'prop': 'P3052'},
-        {'name': 'reddit_id', 'prop': 'P4265'},
-        {'name': 'instagram_id', 'prop': 'P2003'}
-    ]
-
-    updated_properties = [{
-        'name': p['name'],
-        'prop': p['prop'],
-        'datavalue': object.get('entities',{}).get(item_id,{}).get('claims').get(p['prop'],[{}])[0].get('mainsnak',{}).get('datavalue',{})
-    } for p in properties]
-
-    return updated_properties
-
-def requests_retry_session(
-    retries=3,
-    backoff_factor=0.3,
-    status_forcelist=(429, 500, 502, 503, 504),
-    session=None,
-):
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
-def validator_list(field, value, error):
-    if isinstance(value, str):
-        return
-    if isinstance(value, list):
-        for item in value:
-            if not isinstance(item, str):
-                error(field, 'Must be a list with only string values')
-        return
-    error(field, 'Must be a string or a list of strings')
-
-def to_string(value):
-    if isinstance(value, (date, datetime)):
-        return value.isoformat()
-    if isinstance(value, (Decimal)):
-        return str(value)
-    return value
-
-def to_list(value):
-    # if we have a list of strings, create a list from them; if we have
-    # a list of lists, flatten it into a single list of strings
-    if isinstance(value, str):
-        return value.split(",")
-    if isinstance(value, list):
-        return list(itertools.chain.from_iterable(value))
-    return None
+def get_stats():
+    # the function's statistics along with those of the shared code
+    return enricher.get_stats()
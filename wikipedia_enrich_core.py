@@ -0,0 +1,1900 @@
+# Shared code of the wikipedia enrichment functions: the http requests and
+# their time limits, rate limiting and retries, the json parsing, the
+# metrics, the persistent cache and the entity store, along with the
+# EntityEnricher that the people and org functions are built on; the
+# functions import it from the same directory, so the module is loaded once
+# for the process and its settings and state are shared by the functions
+
+import json
+import logging
+import re
+import urllib
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import MaxRetryError, ResponseError
+import itertools
+from datetime import *
+from decimal import *
+from cerberus import Validator
+from collections import OrderedDict
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# the number of top search results considered for a search term; the first
+# of them that's an instance of one of the function's item classes is used
+SEARCH_CANDIDATES = int(os.environ.get('WIKIPEDIA_SEARCH_CANDIDATES', 3))
+
+# the api endpoint; this can point at a mirror or a local stand-in of the
+# api (e.g. the one in wikipedia-enrich-benchmark.py)
+WIKIDATA_API_URL = os.environ.get('WIKIPEDIA_WIKIDATA_API_URL', 'https://www.wikidata.org/w/api.php')
+
+# the json backend used to parse the api responses, the cache values and
+# the results; orjson is used when it's installed unless
+# WIKIPEDIA_JSON_BACKEND is set to 'json'
+JSON_BACKEND = os.environ.get('WIKIPEDIA_JSON_BACKEND', 'orjson')
+if JSON_BACKEND == 'orjson':
+    try:
+        import orjson
+    except ImportError:
+        JSON_BACKEND = 'json'
+
+# for bulk runs, large wbgetentities responses can be decoded and pruned in
+# a pool of WIKIPEDIA_PROCESS_POOL_SIZE processes so that the work isn't
+# limited to one core; the responses grow with the number of items in a
+# batch, so only responses of at least PROCESS_POOL_MIN_BYTES go to the pool
+# and only the pruned entities come back from it; the pool is off by default,
+# and without the fork start method or if the pool fails, the responses are
+# decoded in this process
+PROCESS_POOL_SIZE = int(os.environ.get('WIKIPEDIA_PROCESS_POOL_SIZE', 0))
+PROCESS_POOL_MIN_BYTES = int(os.environ.get('WIKIPEDIA_PROCESS_POOL_MIN_BYTES', 256*1024))
+
+process_pool = None
+process_pool_failed = False
+process_pool_lock = threading.Lock()
+
+# metrics for the stages of each call, the http requests, the json parsing
+# and the caches; the totals are available from get_stats() and, in the
+# prometheus text format, from get_metrics_text(), and each update is passed
+# to the hooks added with add_metrics_hook(), e.g. to send it on to statsd;
+# when WIKIPEDIA_STATSD_ADDRESS (host:port) is set, the updates are sent to
+# statsd over udp; a trace of each row is logged at the debug level; the
+# functions loaded in a process share the metrics
+METRICS_PREFIX = os.environ.get('WIKIPEDIA_METRICS_PREFIX', 'wikipedia_enrich')
+STATSD_ADDRESS = os.environ.get('WIKIPEDIA_STATSD_ADDRESS', '')
+
+logger = logging.getLogger('wikipedia-enrich')
+
+class Metrics(object):
+
+    # counters and timers, keyed by name (e.g. 'http.requests')
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            hooks = self.hooks
+        self.call_hooks(hooks, 'counter', name, value)
+
+    def timing(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {'count': 0, 'sum': 0.0, 'max': 0.0}
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            hooks = self.hooks
+        self.call_hooks(hooks, 'timer', name, seconds)
+
+    def call_hooks(self, hooks, kind, name, value):
+        # a failing hook doesn't fail the call being measured
+        for hook in hooks:
+            try:
+                hook(kind, name, value)
+            except Exception:
+                logger.debug('metrics hook failed', exc_info=True)
+
+    def add_hook(self, hook):
+        with self.lock:
+            self.hooks = self.hooks + [hook]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {k: dict(v) for k, v in self.timers.items()}
+            }
+
+class StageTimer(object):
+
+    # times the stages of a call one after the other; each mark records the
+    # time since the previous mark as the 'stage.<name>' timer
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.times = OrderedDict()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.times[stage] = now - self.last
+        self.metrics.timing('stage.' + stage, now - self.last)
+        self.last = now
+
+    def finish(self):
+        self.metrics.timing('stage.total', time.perf_counter() - self.start)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('stages: %s', ', '.join('%s %.1f ms' % (k, v * 1000) for k, v in self.times.items()))
+
+class StatsdHook(object):
+
+    # sends each update to statsd as a counter or a timer in milliseconds
+
+    def __init__(self, address, prefix):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.socket = None
+
+    def __call__(self, kind, name, value):
+        import socket
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if kind == 'counter':
+            line = '%s.%s:%d|c' % (self.prefix, name, value)
+        else:
+            line = '%s.%s:%.3f|ms' % (self.prefix, name, value * 1000)
+        self.socket.sendto(line.encode('utf-8'), self.address)
+
+metrics = Metrics()
+if STATSD_ADDRESS:
+    metrics.add_hook(StatsdHook(STATSD_ADDRESS, METRICS_PREFIX))
+
+# shared http session so that connections (and their tls handshakes) are
+# reused across requests and across invocations in the same process;
+# HTTP_POOL_CONNECTIONS is the number of hosts to keep pools for,
+# HTTP_POOL_MAXSIZE is the number of connections kept per host and, when
+# HTTP_POOL_BLOCK is set, the most connections opened to a host at a time
+HTTP_POOL_CONNECTIONS = int(os.environ.get('WIKIPEDIA_HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_MAXSIZE = int(os.environ.get('WIKIPEDIA_HTTP_POOL_MAXSIZE', 10))
+HTTP_POOL_BLOCK = os.environ.get('WIKIPEDIA_HTTP_POOL_BLOCK', '1') == '1'
+HTTP_KEEP_ALIVE = os.environ.get('WIKIPEDIA_HTTP_KEEP_ALIVE', '1') == '1'
+
+http_session = None
+http_session_lock = threading.Lock()
+
+# limits on the number of requests made at the same time; the per-host limit
+# should be at most HTTP_POOL_MAXSIZE so that requests don't wait on the
+# connection pool
+HTTP_MAX_CONCURRENCY = int(os.environ.get('WIKIPEDIA_HTTP_MAX_CONCURRENCY', 16))
+HTTP_MAX_CONCURRENCY_PER_HOST = int(os.environ.get('WIKIPEDIA_HTTP_MAX_CONCURRENCY_PER_HOST', 8))
+
+http_executor = None
+
+# the limits are shared by every call in the process, like the rate limiters;
+# they're taken on the thread that makes the request, so they hold across the
+# event loops of the calls as well
+http_limit = None
+http_host_limits = {}
+
+# rate limiting for the requests to each api host; requests wait on a token
+# bucket that starts at RATE_LIMIT_RATE requests per second, grows by
+# RATE_LIMIT_INCREASE after each successful request up to RATE_LIMIT_MAX_RATE
+# and is cut in half (down to RATE_LIMIT_MIN_RATE) when the api throttles us;
+# a throttled request pauses every request to the host for the Retry-After
+# time and is tried again up to RATE_LIMIT_RETRIES times
+RATE_LIMIT_RATE = float(os.environ.get('WIKIPEDIA_RATE_LIMIT_RATE', 10))
+RATE_LIMIT_MIN_RATE = float(os.environ.get('WIKIPEDIA_RATE_LIMIT_MIN_RATE', 1))
+RATE_LIMIT_MAX_RATE = float(os.environ.get('WIKIPEDIA_RATE_LIMIT_MAX_RATE', 50))
+RATE_LIMIT_INCREASE = float(os.environ.get('WIKIPEDIA_RATE_LIMIT_INCREASE', 0.2))
+RATE_LIMIT_RETRIES = int(os.environ.get('WIKIPEDIA_RATE_LIMIT_RETRIES', 3))
+RATE_LIMIT_RETRY_AFTER = float(os.environ.get('WIKIPEDIA_RATE_LIMIT_RETRY_AFTER', 1))
+
+# the time budget of a call in seconds; requests, and retries of throttled
+# requests, that can't be made within what's left of it fail right away
+# and the call returns the values it has; set it to 0 for no time limit;
+# a batch gets another DEADLINE_PER_ROW seconds for each of its rows
+DEADLINE = float(os.environ.get('WIKIPEDIA_DEADLINE', 20))
+DEADLINE_PER_ROW = float(os.environ.get('WIKIPEDIA_DEADLINE_PER_ROW', 0.1))
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+class Deadline(object):
+
+    # the time left of a call's budget
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds if seconds > 0 else None
+
+    def extend(self, seconds):
+        if self.expires is not None:
+            self.expires += seconds
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, wait=0.0):
+        # fail if waiting for the given time would go past the deadline
+        if self.expires is not None and time.monotonic() + wait >= self.expires:
+            metrics.incr('http.deadline_exceeded')
+            raise DeadlineExceeded('Deadline exceeded')
+
+# the deadline of the request being made on each thread
+request_deadline = threading.local()
+
+class DeadlineRetry(Retry):
+
+    # the session's retry policy; a request that fails isn't tried again
+    # when the deadline of the request would pass before the next try; the
+    # retries are counted in http.retries along with the throttled requests
+    # that get_json_request tries again; responses with a Retry-After header
+    # are returned rather than retried (see requests_retry_session)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        deadline = getattr(request_deadline, 'deadline', None)
+        if deadline is not None and deadline.expires is not None and deadline.remaining() <= retry.get_backoff_time():
+            metrics.incr('http.deadline_exceeded')
+            raise MaxRetryError(_pool, url, error or ResponseError('Deadline exceeded'))
+        metrics.incr('http.retries')
+        return retry
+
+# the maxlag parameter sent to wikidata.org asks the api to throttle us
+# when its database replicas are lagging; see https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+WIKIDATA_MAXLAG = int(os.environ.get('WIKIPEDIA_WIKIDATA_MAXLAG', 5))
+
+class RateLimiter(object):
+
+    # token bucket with an additive increase/multiplicative decrease rate
+
+    def __init__(self, rate, min_rate, max_rate, increase):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased = 0.0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttle_events = 0
+
+    def acquire(self, deadline=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        self.requests += 1
+                        return
+                    delay = (1.0 - self.tokens) / self.rate
+                else:
+                    self.updated = now
+                    delay = self.paused_until - now
+            if deadline is not None:
+                deadline.check(delay)
+            time.sleep(delay)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after):
+        with self.lock:
+            now = time.monotonic()
+            self.throttle_events += 1
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+            # requests that were already in flight are often throttled
+            # together, so only cut the rate once for each of them
+            if now - self.decreased > 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate / 2.0)
+                self.decreased = now
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'rate': self.rate,
+                'requests': self.requests,
+                'throttle_events': self.throttle_events,
+                'paused_for': max(0.0, self.paused_until - time.monotonic())
+            }
+
+rate_limiters = {}
+
+# query parameters whose '|' separated values can be given in any order
+UNORDERED_PARAMS = {'ids', 'props', 'languages', 'sitefilter', 'pageids'}
+
+class SingleFlight(object):
+
+    # shares one request between the callers that make the same request at
+    # the same time; the first caller makes the request and the others wait
+    # on its future, either on their own thread or, from the event loop,
+    # with asyncio.wrap_future; the shared result must not be modified
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        # returns the future for the key and whether the caller is the one
+        # to make the request
+        import concurrent.futures
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                metrics.incr('http.coalesced')
+                return future, False
+            future = concurrent.futures.Future()
+            self.calls[key] = future
+            self.requests += 1
+            return future, True
+
+    def run(self, key, future, fn, *args):
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            with self.lock:
+                self.calls.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.calls.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def do(self, key, fn, *args, deadline=None):
+        import concurrent.futures
+        future, first = self.join(key)
+        if not first:
+            try:
+                return future.result(deadline.remaining() if deadline is not None else None)
+            except concurrent.futures.TimeoutError:
+                raise DeadlineExceeded('Deadline exceeded')
+        return self.run(key, future, fn, *args)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls)
+            }
+
+single_flight = SingleFlight()
+
+# persistent cache for search results, entities and entity labels; an entry
+# expires after CACHE_TTL seconds and the least recently used entries are
+# evicted once there are more than CACHE_MAX_ENTRIES; set the path to an
+# empty string to turn the cache off
+#
+# expired entries are kept for another CACHE_REVALIDATE_TTL seconds; when
+# the entities of expired entries are needed again, their revisions are
+# checked with one props=info request for every 50 entities and only the
+# entities that have changed are fetched again in full, while the others
+# are used from the cache for another CACHE_TTL; set it to 0 to always
+# fetch the entities of expired entries again
+#
+# entries that expired less than CACHE_STALE_TTL seconds ago are used as they
+# are so that the call doesn't wait for them, and the rows that used them are
+# refreshed afterwards in the background, one refresh at a time for each
+# search term; set it to 0 to wait for expired entries to be refreshed;
+# searches that don't find an item are cached for CACHE_NEGATIVE_TTL seconds
+# so that they aren't searched for again on every call
+CACHE_PATH = os.environ.get('WIKIPEDIA_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'wikipedia-enrich-cache.sqlite'))
+CACHE_TTL = int(os.environ.get('WIKIPEDIA_CACHE_TTL', 24*60*60))
+CACHE_REVALIDATE_TTL = int(os.environ.get('WIKIPEDIA_CACHE_REVALIDATE_TTL', 7*24*60*60))
+CACHE_STALE_TTL = int(os.environ.get('WIKIPEDIA_CACHE_STALE_TTL', 60*60))
+CACHE_NEGATIVE_TTL = int(os.environ.get('WIKIPEDIA_CACHE_NEGATIVE_TTL', 60*60))
+CACHE_MAX_ENTRIES = int(os.environ.get('WIKIPEDIA_CACHE_MAX_ENTRIES', 100000))
+
+# the people and org functions share the cache; the entries that depend on
+# the function, like the item chosen for a search term from its candidates
+# and the entities, which only keep the claims the function uses, are kept
+# apart by storing their kinds under the function's namespace (see
+# EntityEnricher.get_cache_kind); the labels of entity values don't depend
+# on the function and are shared
+CACHE_NAMESPACE_KINDS = ['search', 'entity']
+
+cache_connection = None
+cache_lock = threading.Lock()
+
+class CacheRefresher(object):
+
+    # refreshes cache entries in the background on a worker thread; keys that
+    # are already waiting to be refreshed or being refreshed are left out
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, keys, fn, *args):
+
+        # call fn(keys, *args) in the background with the keys that aren't
+        # already being refreshed
+        import concurrent.futures
+        with self.lock:
+            new_keys = [k for k in keys if k not in self.pending]
+            self.pending.update(new_keys)
+            if len(new_keys) > 0 and self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cache-refresh')
+        if len(keys) > len(new_keys):
+            metrics.incr('cache.refresh.deduplicated', len(keys) - len(new_keys))
+        if len(new_keys) == 0:
+            return None
+        metrics.incr('cache.refresh.scheduled', len(new_keys))
+        return self.executor.submit(self.run, new_keys, fn, args)
+
+    def run(self, keys, fn, args):
+        try:
+            fn(keys, *args)
+        except Exception:
+            metrics.incr('cache.refresh.errors')
+            logger.exception('cache refresh failed')
+        finally:
+            with self.lock:
+                self.pending.difference_update(keys)
+
+    def get_stats(self):
+        with self.lock:
+            return {'pending': len(self.pending)}
+
+
+# local entity store built from a wikidata dump with wikidata-dump-ingest.py;
+# when a path is set, the searches and entities are looked up in the store
+# instead of the wikidata api
+ENTITY_STORE_PATH = os.environ.get('WIKIPEDIA_ENTITY_STORE_PATH', '')
+
+store_connection = None
+
+# in-process index used to resolve search terms without a search request;
+# the index is loaded from the search results in the cache (or the labels and
+# aliases in the entity store) when it's first used and learns the item chosen
+# for each search term; the labels of the items aren't added since an item
+# chosen for one search term (or only fetched as a candidate) isn't an answer
+# to a search for its label; a search term is only resolved by the index when
+# its top item has at least SEARCH_INDEX_MIN_MARGIN times the weight of the
+# next item; the items learned from searches and the cache expire with the
+# cache entries they come from, so expired search terms go through the cache
+# again
+SEARCH_INDEX_MAX_NAMES = int(os.environ.get('WIKIPEDIA_SEARCH_INDEX_MAX_NAMES', 200000))
+SEARCH_INDEX_MIN_MARGIN = float(os.environ.get('WIKIPEDIA_SEARCH_INDEX_MIN_MARGIN', 2))
+SEARCH_INDEX_SEARCH_WEIGHT = 10
+
+class SearchIndex(object):
+
+    # index of (language, normalized name) to the weight of each item with the
+    # name and when the item expires for the name (None if it doesn't)
+
+    def __init__(self, max_names, min_margin):
+        self.max_names = max_names
+        self.min_margin = min_margin
+        self.names = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, language, name, item_id, weight, expires=None):
+        key = (language, normalize_name(name))
+        with self.lock:
+            items = self.names.get(key)
+            if items is None:
+                if len(self.names) >= self.max_names:
+                    return
+                items = self.names[key] = {}
+            if item_id in items:
+                item_weight, item_expires = items[item_id]
+                if item_expires is not None and expires is not None:
+                    expires = max(item_expires, expires)
+                elif item_expires is None:
+                    expires = None
+                weight += item_weight
+            items[item_id] = (weight, expires)
+
+    def lookup(self, language, name):
+        key = (language, normalize_name(name))
+        with self.lock:
+            items = self.names.get(key, {})
+            now = time.time()
+            for item_id in [i for i, (w, e) in items.items() if e is not None and e <= now]:
+                del items[item_id]
+            if key in self.names and len(items) == 0:
+                del self.names[key]
+            ranked = sorted((w for w, e in items.values()), reverse=True)
+            if len(ranked) == 0 or (len(ranked) > 1 and ranked[0] < self.min_margin * ranked[1]):
+                self.misses += 1
+                metrics.incr('search_index.misses')
+                return None
+            self.hits += 1
+            metrics.incr('search_index.hits')
+            return max(items.keys(), key=lambda i: items[i][0])
+
+    def get_stats(self):
+        with self.lock:
+            return {'names': len(self.names), 'hits': self.hits, 'misses': self.misses}
+
+
+# in-process cache of the labels of entity values (countries, genders,
+# occupations, etc); a small set of entities makes up most of the lookups
+LABEL_CACHE_SIZE = int(os.environ.get('WIKIPEDIA_LABEL_CACHE_SIZE', 10000))
+
+class LabelCache(object):
+
+    # least recently used cache of entity labels keyed by (entity id, language)
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.labels = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.labels:
+                self.misses += 1
+                metrics.incr('label_cache.misses')
+                return None
+            self.labels.move_to_end(key)
+            self.hits += 1
+            metrics.incr('label_cache.hits')
+            return self.labels[key]
+
+    def put(self, key, label):
+        with self.lock:
+            self.labels[key] = label
+            self.labels.move_to_end(key)
+            while len(self.labels) > self.max_size:
+                self.labels.popitem(last=False)
+
+    def get_stats(self):
+        with self.lock:
+            return {'size': len(self.labels), 'hits': self.hits, 'misses': self.misses}
+
+label_cache = LabelCache(LABEL_CACHE_SIZE)
+
+# language codes as used by wikidata (e.g. 'en', 'pt-br')
+LANGUAGE_PATTERN = re.compile(r'^[a-z]{2,3}(-[a-z0-9]+)*$')
+
+validator = None
+validator_lock = threading.Lock()
+
+# the claims kept by the process pool when it decodes the entities: the
+# claims kept by any of the functions (see EntityEnricher)
+pooled_claim_props = set(['P31'])
+
+class ItemInfo(object):
+
+    # the values of an item's properties in a language, in the order of the
+    # function's properties
+
+    __slots__ = ('property_index', 'values')
+
+    def __init__(self, property_index):
+        self.property_index = property_index
+        self.values = [''] * len(property_index)
+
+    def set(self, name, value):
+        self.values[self.property_index[name]] = value or ''
+
+class ClaimInfo(object):
+
+    # a requested claim of an item: the datavalues of the statements picked
+    # for the claim and, once they've been resolved, its value
+
+    __slots__ = ('name', 'policy', 'separator', 'datavalues', 'value')
+
+    def __init__(self, name, policy, separator, datavalues):
+        self.name = name
+        self.policy = policy
+        self.separator = separator
+        self.datavalues = datavalues
+        self.value = None
+
+class EntityEnricher(object):
+
+    # enriches rows with the wikidata items found for their search terms; the
+    # people and org functions each have one, set up with the classes their
+    # items should be an instance of (P31), the properties they return, in
+    # the order they're returned for '*', and their claims (see the
+    # function's CLAIM_PROPERTIES), the namespace of their cache entries and
+    # their logger
+
+    def __init__(self, namespace, item_classes, default_properties, claim_properties, logger):
+        self.namespace = namespace
+        self.item_classes = item_classes
+        self.default_properties = default_properties
+        self.claim_properties = claim_properties
+        self.logger = logger
+
+        # the claims kept from the fetched entities: the instance of (P31)
+        # claim used to pick the search candidate and the function's claims
+        self.entity_claim_props = ['P31'] + [p['prop'] for p in claim_properties]
+        pooled_claim_props.update(self.entity_claim_props)
+
+        # the values returned for an item are kept in a list in the order of
+        # the default properties, rather than in a dict for each item, and the
+        # result rows are built from the lists using the position of each property
+        self.property_index = {name: idx for idx, name in enumerate(default_properties.keys())}
+        self.property_names = list(default_properties.keys())
+
+        self.search_index = SearchIndex(SEARCH_INDEX_MAX_NAMES, SEARCH_INDEX_MIN_MARGIN)
+        self.cache_refresher = CacheRefresher(1)
+
+    def flexio_handler(self, flex):
+
+        # the call's time budget starts now
+        deadline = Deadline(DEADLINE)
+
+        # get the input
+        input = flex.input.read()
+        try:
+            input = json.loads(input)
+            if not isinstance(input, list): raise ValueError
+        except ValueError:
+            raise ValueError
+
+        # map the values to the parameter names based on the positions of the
+        # keys/values and validate the mapped input against the validator
+        # if the input is valid return an error
+        v = get_validator()
+        with validator_lock:
+            input = dict(zip(v.schema.keys(), input))
+            input = v.validated(input)
+        if input is None:
+            raise ValueError
+
+        # get the rows to enrich; a single search term is enriched as a batch
+        # with one row so that both input forms share the same lookups, and the
+        # call's time budget grows with the number of rows
+        rows = get_input_rows(input['search'], input['properties'])
+        languages = get_languages(input['language'])
+        deadline.extend(DEADLINE_PER_ROW * len(rows))
+
+        # build up the result
+        result = self.enrich_rows(rows, languages, deadline=deadline)
+
+        # return the results
+        result = dumps_json(result)
+        flex.output.content_type = "application/json"
+        flex.output.write(result)
+
+    def enrich_rows(self, rows, languages, refresh=False, deadline=None):
+
+        # see here for general information about the wikidata api: https://www.wikidata.org/wiki/Wikidata:Data_access
+        # see here for list of sorted properties: https://www.wikidata.org/wiki/MediaWiki:Wikibase-SortedProperties
+
+        # use the shared session for all the requests in the batch; the searches
+        # are made in the first language and the items are fetched once for all
+        # the languages; stale cache entries are used and the rows that used
+        # them are refreshed in the background, unless this is the refresh; the
+        # requests in every step are made within the call's deadline and when
+        # the deadline passes, the rest of the steps use what's been found
+        session = get_session()
+        language = languages[0]
+        if deadline is None:
+            deadline = Deadline(DEADLINE)
+            deadline.extend(DEADLINE_PER_ROW * len(rows))
+        timer = StageTimer(metrics)
+        if not refresh:
+            metrics.incr('rows', len(rows))
+        stale_searches = None if refresh else set()
+        stale_ids = None if refresh else set()
+        stale_label_ids = None if refresh else set()
+
+        # if a row has a wildcard, get all the properties
+        for row in rows:
+            if len(row['properties']) == 1 and row['properties'][0] == '*':
+                row['properties'] = self.property_names
+
+        # STEP 1: make an initial search request to find the most relevant item;
+        # repeated search terms are only searched once and the searches for the
+        # rows are made at the same time
+        # https://www.wikidata.org/w/api.php?action=wbsearchentities&language=en&search=:search_term
+        searches = unique_list([row['search'] for row in rows])
+        search_candidate_ids, searched = self.get_search_candidate_ids(session, searches, language, stale_searches, use_index=not refresh, deadline=deadline)
+        timer.mark('search')
+
+        # STEP 2: get the info about the items; the candidates for all the rows
+        # are packed together into as few requests as possible and items found by
+        # more than one search term are only fetched once; only the parts of the
+        # items needed for the requested properties are fetched, along with the
+        # claims when there's more than one candidate to choose from
+        # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
+        candidate_ids = unique_list([i for s in searches for i in search_candidate_ids.get(s, [])])
+        props = get_entity_props(set().union(*[row['properties'] for row in rows if search_candidate_ids.get(row['search'])]), self.default_properties)
+        if any(len(ids) > 1 for ids in search_candidate_ids.values()):
+            props = '|'.join(unique_list(props.split('|') + ['claims']))
+        content = self.get_entities(session, candidate_ids, props, languages, cache_kind='entity', stale_ids=stale_ids, deadline=deadline)
+
+        # confirm we have the kind of item the function looks for: use the first
+        # candidate that's an instance of (P31) one of the item classes, then
+        # remember the item for the search terms that were searched for and
+        # whose candidates were all fetched
+        search_item_ids = {s: self.get_candidate_item_id(content, ids) for s, ids in search_candidate_ids.items()}
+        self.put_search_item_ids([s for s in searched if all(i in content['entities'] for i in search_candidate_ids[s])], search_item_ids, language)
+        item_ids = unique_list(search_item_ids.values())
+
+        timer.mark('fetch')
+
+        # get the properties requested for each item
+        item_properties = {}
+        for row in rows:
+            item_id = search_item_ids.get(row['search'])
+            if item_id:
+                item_properties.setdefault(item_id, set()).update(row['properties'])
+
+        # STEP 3: get primary item info and additional info for each language;
+        # items that couldn't be fetched are left out so that their rows are
+        # returned empty; the info is keyed by (item id, language)
+        item_ids = [i for i in item_ids if i in content['entities']]
+        item_keys = [(item_id, l) for item_id in item_ids for l in languages]
+        item_info = {}
+        item_claim_info = {}
+        for item_id, l in item_keys:
+            item_info[(item_id, l)] = self.get_basic_info(content, item_id, l)
+            item_claim_info[(item_id, l)] = self.get_claim_info(content, item_id, l, item_properties[item_id])
+        timer.mark('extract')
+
+        # STEP 4: make an additional lookup to find out the info from the wikipedia entity values;
+        # values with a label in the label cache or that refer to items already fetched
+        # in STEP 2 are resolved first, then the remaining entity values for all the
+        # items are looked up together; if there aren't any (e.g. when none of the
+        # requested properties are entity values), the lookup is skipped; in a
+        # refresh, all the entity values are looked up so that the label cache
+        # is refreshed as well
+        # https://www.wikidata.org/w/api.php?action=wbgetentities&sites=enwiki&props=claims&format=json&ids=:id
+        for item_id, l in item_keys:
+            for i in item_claim_info[(item_id, l)]:
+                update_claim_info(i, content, l)
+
+        props = 'labels|info'
+        search_ids = unique_list([entity_id for k in item_keys for i in item_claim_info[k] if i.value is None or refresh for entity_id in get_claim_entity_ids(i)])
+        if len(search_ids) > 0:
+            content = self.get_entities(session, search_ids, props, languages, content, cache_kind='labels', stale_ids=stale_label_ids, deadline=deadline)
+
+        # remove any expired entries and evict the least recently used entries
+        trim_cache()
+        timer.mark('labels')
+
+        # STEP 5: use the info from the additional lookup to populate the remaining
+        # values and add the values of the claims to the item info; the items
+        # whose labels couldn't be looked up (e.g. when the deadline passed) are
+        # returned as their ids and the item info is partial
+        for k in item_keys:
+            for i in item_claim_info[k]:
+                if i.value is None or refresh:
+                    update_claim_info(i, content, k[1])
+                if i.value is None:
+                    update_claim_info(i, content, k[1], use_ids=True)
+                    item_info[k].set('partial', 'true')
+                item_info[k].set(i.name, i.value)
+
+        # the search terms with a stale search result, candidate or label
+        if not refresh:
+            stale_item_ids = set(k[0] for k in item_keys if any(e in stale_label_ids for i in item_claim_info[k] for e in get_claim_entity_ids(i)))
+            stale_searches.update(s for s, ids in search_candidate_ids.items() if any(i in stale_ids for i in ids) or search_item_ids.get(s) in stale_item_ids)
+        timer.mark('resolve')
+
+        # STEP 6: build up a result row for each input row from the values of
+        # its item; with more than one language, each property is returned once
+        # for each language; rows usually share their list of properties, so
+        # the positions of the properties are looked up once for each list; rows
+        # whose search or item couldn't be looked up are partial and are
+        # returned with empty values
+        result = []
+        property_indexes = {}
+        partial_info = ItemInfo(self.property_index)
+        partial_info.set('partial', 'true')
+        partial_count = 0
+        trace = self.logger.isEnabledFor(logging.DEBUG)
+        for row_number, row in enumerate(rows, 1):
+            item_id = search_item_ids.get(row['search'])
+            if trace:
+                self.logger.debug('row %d: search %r, %s, candidates %s, item %s', row_number, row['search'],
+                             'searched' if row['search'] in searched else 'search cached', search_candidate_ids.get(row['search'], []), item_id)
+            partial = (row['search'] != '' and row['search'] not in search_item_ids) or (item_id is not None and item_id not in content['entities'])
+            if (item_id, language) not in item_info and not partial:
+                result.append([""])
+                continue
+
+            indexes = property_indexes.get(id(row['properties']))
+            if indexes is None:
+                indexes = property_indexes[id(row['properties'])] = [self.property_index.get(p) for p in row['properties']]
+            item_values = [partial_info.values] * len(languages) if partial else [item_info[(item_id, l)].values for l in languages]
+            result.append([values[idx] if idx is not None else '' for idx in indexes for values in item_values])
+            if item_values[0][self.property_index['partial']]:
+                partial_count += 1
+
+        if partial_count > 0:
+            metrics.incr('rows.partial', partial_count)
+            self.logger.warning('%d of %d rows are partial%s', partial_count, len(rows), ' (deadline exceeded)' if deadline.expired() else '')
+
+        timer.mark('merge')
+        timer.finish()
+
+        # refresh the rows with stale cache entries once the result is ready
+        if not refresh and len(stale_searches) > 0:
+            refresh_rows = OrderedDict(((tuple(languages), row['search']), row) for row in rows if row['search'] in stale_searches)
+            self.cache_refresher.submit(list(refresh_rows.keys()), self.refresh_cache_rows, refresh_rows, languages)
+        return result
+
+    def refresh_cache_rows(self, keys, rows, languages):
+
+        # enrich the rows again without using stale cache entries so that the
+        # entries are searched for, revalidated or fetched again
+        self.enrich_rows([rows[k] for k in keys], languages, refresh=True)
+
+    def get_search_candidate_ids(self, session, searches, language, stale_searches=None, use_index=True, deadline=None):
+
+        # get the candidate items for each search term along with the search terms
+        # that were searched for; search terms resolved by the search index or the
+        # cache have a single candidate, the item chosen when they were searched
+        # for, or none when nothing was found; search terms whose search fails
+        # are left out; when stale_searches is a set, stale cached results are
+        # used and their search terms are added to it
+
+        # resolve the search terms the search index is confident about
+        search_candidate_ids = {}
+        if use_index:
+            index = self.get_search_index()
+            for search in searches:
+                item_id = index.lookup(language, search)
+                if item_id is not None:
+                    search_candidate_ids[search] = [item_id]
+            searches = [search for search in searches if search not in search_candidate_ids]
+
+        # when there's a local entity store, look up the rest of the search terms in its index
+        if ENTITY_STORE_PATH:
+            search_candidate_ids.update(get_store_search_candidate_ids(searches, language))
+            return search_candidate_ids, searches
+
+        # use the cached search results we have
+        cache_keys = OrderedDict((language + ':' + search, search) for search in searches)
+        stale_keys = None if stale_searches is None else set()
+        cache_values = get_cache_values(self.get_cache_kind('search'), list(cache_keys.keys()), stale_keys=stale_keys)
+        search_candidate_ids.update({cache_keys[k]: [v] if v else [] for k, v in cache_values.items()})
+        if stale_keys:
+            stale_searches.update(cache_keys[k] for k in stale_keys)
+
+        # search for the rest of the terms
+        searches = [search for search in searches if search not in search_candidate_ids]
+        urls = []
+        for search in searches:
+            url_query_params = {'action': 'wbsearchentities', 'language': language, 'format': 'json', 'limit': SEARCH_CANDIDATES, 'maxlag': WIKIDATA_MAXLAG, 'search': search}
+            url_query_str = urllib.parse.urlencode(url_query_params)
+            urls.append(WIKIDATA_API_URL + '?' + url_query_str)
+
+        for search, search_info in zip(searches, get_json_responses(session, urls, deadline)):
+            if isinstance(search_info, Exception):
+                continue
+            search_items = search_info.get('search', [])
+            search_candidate_ids[search] = unique_list([i.get('id','') for i in search_items[:SEARCH_CANDIDATES]])
+
+        return search_candidate_ids, [search for search in searches if search in search_candidate_ids]
+
+    def get_candidate_item_id(self, content, candidate_ids):
+
+        # the first candidate that's an instance of one of the item classes or,
+        # if none of them are, the top candidate
+        for item_id in candidate_ids:
+            statements = content.get('entities',{}).get(item_id,{}).get('claims',{}).get('P31',[])
+            if any(s.get('mainsnak',{}).get('datavalue',{}).get('value',{}).get('id') in self.item_classes for s in statements):
+                return item_id
+
+        return candidate_ids[0] if len(candidate_ids) > 0 else None
+
+    def put_search_item_ids(self, searches, search_item_ids, language):
+
+        # cache the items chosen for the search terms and add them to the search
+        # index; search terms that didn't find an item are cached for a shorter
+        # time with an empty item
+        if ENTITY_STORE_PATH:
+            return
+
+        index = self.get_search_index()
+        cache_entries = []
+        negative_cache_entries = []
+        for search in searches:
+            item_id = search_item_ids.get(search)
+            if item_id is not None:
+                cache_entries.append((language + ':' + search, item_id, '', item_id))
+                index.add(language, search, item_id, SEARCH_INDEX_SEARCH_WEIGHT, time.time() + CACHE_TTL)
+            else:
+                negative_cache_entries.append((language + ':' + search, '', '', ''))
+
+        put_cache_values(self.get_cache_kind('search'), cache_entries)
+        put_cache_values(self.get_cache_kind('search'), negative_cache_entries, CACHE_NEGATIVE_TTL)
+
+    def get_entities(self, session, ids, props, languages, content=None, cache_kind=None, stale_ids=None, deadline=None):
+
+        # get the entities for the ids, adding them to any content we already have;
+        # entities already in the content with the parts we need aren't requested
+        # again; labels, descriptions and sitelinks are only fetched for the languages;
+        # when stale_ids is a set, stale cached entities are used and their ids
+        # are added to it
+        content = content or {'entities': {}}
+        content.setdefault('entities', {})
+        requested_languages = list(languages)
+        languages = list(languages)
+
+        # when there's a local entity store, get the entities from the store
+        if ENTITY_STORE_PATH:
+            pending_ids = [i for i in unique_list(ids) if not has_entity_props(content['entities'].get(i), props)]
+            for k, v in get_store_entities(pending_ids).items():
+                content['entities'][k] = merge_entity(content['entities'].get(k), v)
+            return content
+
+        # use the cached entities that have the parts we need; entities cached
+        # with other parts are fetched again along with the parts they have so
+        # that the cache entry keeps them; entities cached without some of the
+        # languages keep their claims, which don't depend on the language, and
+        # only the parts that do are fetched for them
+        cached_values = {}
+        if cache_kind is not None:
+            cache_kind = self.get_cache_kind(cache_kind)
+            cache_ids = [i for i in unique_list(ids) if not has_entity_props(content['entities'].get(i), props)]
+            stale_keys = None if stale_ids is None else set()
+            cache_values = get_cache_values(cache_kind, cache_ids, stale_keys=stale_keys)
+            if stale_keys:
+                stale_ids.update(stale_keys)
+            cache_values.update(self.get_revalidated_cache_values(session, cache_kind, [i for i in cache_ids if i not in cache_values], props, deadline))
+            for item_id, cache_value in cache_values.items():
+                if not has_entity_props(cache_value.get('entity'), props):
+                    props = '|'.join(unique_list(props.split('|') + cache_value.get('props', '').split('|')))
+                    languages = unique_list(languages + cache_value.get('languages', []))
+                    continue
+                content['entities'][item_id] = merge_entity(content['entities'].get(item_id), cache_value['entity'])
+                if not all(l in cache_value.get('languages', []) for l in requested_languages):
+                    cached_values[item_id] = cache_value
+
+        language_props = '|'.join(p for p in props.split('|') if p != 'claims')
+        urls = get_entity_urls(get_entity_request_ids(ids, content, props), props, languages)
+        urls += get_entity_urls(get_entity_request_ids(list(cached_values.keys()), {}, language_props), language_props, requested_languages)
+        fetched_entities = self.get_fetched_entities(session, urls, deadline)
+
+        # entities that have changed since they were cached are fetched again
+        # with all of their parts so that the claims are from the same revision
+        cache_entries = []
+        changed_ids = []
+        for item_id, cache_value in cached_values.items():
+            entity = fetched_entities.get(item_id)
+            if entity is None or 'missing' in entity:
+                continue
+            cached_props = '|'.join(unique_list(cache_value.get('props', '').split('|') + language_props.split('|')))
+            cached_languages = unique_list(cache_value.get('languages', []) + requested_languages)
+            if entity.get('modified','') != cache_value['entity'].get('modified',''):
+                changed_ids.append(item_id)
+                del fetched_entities[item_id]
+                continue
+            cache_entries.append((item_id, item_id, entity.get('modified',''), {'props': cached_props, 'languages': cached_languages, 'entity': merge_entity(cache_value['entity'], entity)}))
+        if len(changed_ids) > 0:
+            changed_props = '|'.join(unique_list(props.split('|') + [p for i in changed_ids for p in cached_values[i].get('props', '').split('|')]))
+            changed_languages = unique_list(languages + [l for i in changed_ids for l in cached_values[i].get('languages', [])])
+            changed_entities = self.get_fetched_entities(session, get_entity_urls(get_entity_request_ids(changed_ids, {}, changed_props), changed_props, changed_languages), deadline)
+            fetched_entities.update(changed_entities)
+            cache_entries.extend((k, k, v.get('modified',''), {'props': changed_props, 'languages': changed_languages, 'entity': v}) for k, v in changed_entities.items() if 'missing' not in v)
+
+        # cache the entities we fetched along with their modified date so that
+        # entries from an older revision of an entity are refreshed
+        if cache_kind is not None:
+            cache_entries.extend((k, k, v.get('modified',''), {'props': props, 'languages': languages, 'entity': v}) for k, v in fetched_entities.items() if 'missing' not in v and k not in cached_values)
+            put_cache_values(cache_kind, cache_entries)
+
+        for k, v in fetched_entities.items():
+            content['entities'][k] = merge_entity(content['entities'].get(k), v)
+        return content
+
+    def get_revalidated_cache_values(self, session, cache_kind, ids, props, deadline=None):
+
+        # get the expired cached entities for the ids that are still current; the
+        # revisions of the entities are checked with props=info requests, which
+        # return a few bytes for each entity, and the entries of the entities
+        # that haven't changed are kept for another CACHE_TTL; the entities that
+        # have changed aren't returned and are fetched again in full; if the
+        # deadline passes before an entity is checked, the expired entity is used
+        if CACHE_REVALIDATE_TTL <= 0 or len(ids) == 0:
+            return {}
+
+        stale_values = {k: v for k, v in get_cache_values(cache_kind, ids, stale=True).items() if has_entity_props(v.get('entity'), props)}
+        if len(stale_values) == 0:
+            return {}
+
+        revisions = self.get_fetched_entities(session, get_entity_urls(get_entity_request_ids(list(stale_values.keys()), {}, 'info'), 'info', []), deadline)
+        values = {k: v for k, v in stale_values.items() if is_same_revision(v['entity'], revisions.get(k))}
+        touch_cache_values(cache_kind, list(values.keys()))
+        if deadline is not None and deadline.expired():
+            values.update((k, v) for k, v in stale_values.items() if k not in revisions)
+
+        metrics.incr('cache.' + cache_kind + '.revalidated', len(values))
+        if len(stale_values) > len(values):
+            metrics.incr('cache.' + cache_kind + '.changed', len(stale_values) - len(values))
+        return values
+
+    def get_fetched_entities(self, session, urls, deadline=None):
+        # the entities in a request that fails are left out
+        fetched_entities = {}
+        for entity_info in get_json_responses(session, urls, deadline):
+            if not isinstance(entity_info, Exception):
+                fetched_entities.update((k, prune_entity(v, self.entity_claim_props)) for k, v in entity_info.get('entities', {}).items())
+        return fetched_entities
+
+    def get_search_index(self):
+
+        # load the index the first time it's used
+        with self.search_index.lock:
+            loaded = self.search_index.loaded
+            self.search_index.loaded = True
+        if not loaded:
+            if ENTITY_STORE_PATH:
+                self.load_search_index_from_store(self.search_index)
+            else:
+                self.load_search_index_from_cache(self.search_index)
+        return self.search_index
+
+    def load_search_index_from_cache(self, index):
+
+        # add the cached search results, most recently used first; search terms
+        # cached without an item are left to the cache so that they aren't
+        # taken for an item
+        connection = get_cache_connection()
+        if connection is None:
+            return
+
+        with cache_lock:
+            try:
+                cache_rows = connection.execute("select key, value, expires from cache where kind = ? and expires > ? order by accessed desc limit ?",
+                    [self.get_cache_kind('search'), time.time(), index.max_names]).fetchall()
+            except sqlite3.Error:
+                return
+
+        for key, value, expires in cache_rows:
+            value = loads_json(value)
+            if value == '':
+                continue
+            language, search = key.split(':', 1)
+            index.add(language, search, value, SEARCH_INDEX_SEARCH_WEIGHT, expires)
+
+    def load_search_index_from_store(self, index):
+
+        # add the names in the entity store with the most sitelinks
+        connection = get_store_connection()
+        with cache_lock:
+            store_rows = connection.execute('select language, name, id, weight from names order by weight desc limit ?', [index.max_names]).fetchall()
+        for language, name, item_id, weight in store_rows:
+            index.add(language, name, item_id, weight)
+
+    def get_cache_kind(self, kind):
+        # the kind the entries are stored under
+        return self.namespace + '.' + kind if kind in CACHE_NAMESPACE_KINDS else kind
+
+    def get_basic_info(self, object, item_id, language):
+        entity = object.get('entities',{}).get(item_id,{})
+        item_info = ItemInfo(self.property_index)
+        item_info.set('label', entity.get('labels',{}).get(language, {}).get('value',''))
+        item_info.set('description', entity.get('descriptions',{}).get(language, {}).get('value',''))
+        item_info.set('updated_dt', entity.get('modified',''))
+        item_info.set('wikipedia_url', entity.get('sitelinks',{}).get(language+'wiki',{}).get('url',''))
+        return item_info
+
+    def get_claim_info(self, object, item_id, language, names=None):
+
+        # get the values of the requested claims in one pass over the item's
+        # claims; the values are the datavalues of the statements picked for
+        # each property and are resolved by update_claim_info
+        claims = object.get('entities',{}).get(item_id,{}).get('claims',{})
+        claim_info = []
+        for p in self.claim_properties:
+            if names is not None and p['name'] not in names:
+                continue
+            statements = get_claim_statements(claims.get(p['prop'],[]), p, language)
+            claim_info.append(ClaimInfo(p['name'], p.get('values', 'preferred'), p.get('separator', ', '),
+                                        [s.get('mainsnak',{}).get('datavalue',{}) for s in statements]))
+
+        return claim_info
+
+    def get_stats(self):
+
+        # all of the function's statistics in one place
+        stats = get_stats()
+        stats.update({
+            'search_index': self.search_index.get_stats(),
+            'cache_refresher': self.cache_refresher.get_stats()
+        })
+        return stats
+
+def get_languages(language):
+
+    # the languages to return the values in; the first language is also the
+    # one the search terms are matched in
+    languages = unique_list([str(l).lower().strip() for l in language]) or ['en']
+    if not all(LANGUAGE_PATTERN.match(l) for l in languages):
+        raise ValueError
+    return languages
+
+def get_input_rows(search, properties):
+
+    # a batch is either a list of search terms (e.g. a column of cells) or
+    # a list of [search, properties] rows; rows without their own properties
+    # use the properties passed for the whole call
+    if isinstance(search, str):
+        search = [search]
+
+    # the rows without their own properties share one list of properties
+    properties = get_property_names(properties)
+
+    rows = []
+    for item in search:
+        row_properties = properties
+        if isinstance(item, list):
+            if len(item) > 1 and item[1]:
+                row_properties = get_property_names(item[1].split(",") if isinstance(item[1], str) else to_list(item[1]))
+            item = item[0] if len(item) > 0 else ''
+        if item is None:
+            item = ''
+        if isinstance(item, (list, dict)) or row_properties is None:
+            raise ValueError
+        rows.append({
+            'search': str(item).strip(),
+            'properties': row_properties
+        })
+
+    return rows
+
+def get_property_names(properties):
+    if not isinstance(properties, list):
+        return None
+    return [str(p).lower().strip() for p in properties]
+
+def get_entity_props(properties, default_properties):
+
+    # get the parts of the items to fetch for the requested properties; the
+    # info is always fetched since the cache uses the modified date
+    basic_props = {'label': 'labels', 'description': 'descriptions', 'wikipedia_url': 'sitelinks/urls', 'updated_dt': 'info', 'partial': 'info'}
+    props = ['info'] + [basic_props[p] for p in basic_props.keys() if p in properties]
+    if any(p in default_properties and p not in basic_props for p in properties):
+        props.append('claims')
+    return '|'.join(unique_list(props))
+
+def has_entity_props(entity, props):
+
+    # true if the entity content includes all the parts in the props
+    prop_keys = {'info': 'modified', 'labels': 'labels', 'descriptions': 'descriptions', 'claims': 'claims', 'sitelinks': 'sitelinks', 'sitelinks/urls': 'sitelinks'}
+    if entity is None:
+        return False
+    if 'missing' in entity:
+        return True
+    return all(prop_keys.get(p, p) in entity for p in props.split('|'))
+
+def is_same_revision(entity, revision):
+
+    # true if the revision info is for the same revision of the entity; the
+    # revision id is used when both have it and otherwise the modified date
+    if revision is None or 'missing' in revision:
+        return False
+    if entity.get('lastrevid') and revision.get('lastrevid'):
+        return entity['lastrevid'] == revision['lastrevid']
+    return entity.get('modified','') != '' and entity.get('modified','') == revision.get('modified','')
+
+def get_entity_urls(ids_params, props, languages):
+    urls = []
+    for ids_param in ids_params:
+        url_query_params = {'action': 'wbgetentities', 'sites': 'enwiki', 'props': props, 'format': 'json', 'maxlag': WIKIDATA_MAXLAG, 'ids': ids_param}
+        if len(languages) > 0:
+            url_query_params['languages'] = '|'.join(languages)
+        if 'sitelinks' in props:
+            url_query_params['sitefilter'] = '|'.join(l + 'wiki' for l in languages)
+        url_query_str = urllib.parse.urlencode(url_query_params)
+        urls.append(WIKIDATA_API_URL + '?' + url_query_str)
+    return urls
+
+def prune_entity(entity, claim_props):
+
+    # the api returns every claim of an entity, with its references and
+    # qualifiers; keep only the statements for the claims we use, with their
+    # value, rank and end time qualifier, so that less is kept in memory and
+    # in the cache; the parsed response may be shared, so it isn't modified
+    if 'claims' not in entity:
+        return entity
+    claims = {}
+    for prop in claim_props:
+        statements = entity['claims'].get(prop)
+        if statements:
+            claims[prop] = [prune_statement(s) for s in statements]
+    return dict(entity, claims=claims)
+
+def prune_statement(statement):
+    pruned_statement = {
+        'mainsnak': {'datavalue': statement.get('mainsnak', {}).get('datavalue', {})},
+        'rank': statement.get('rank', 'normal')
+    }
+    if 'P582' in statement.get('qualifiers', {}):
+        pruned_statement['qualifiers'] = {'P582': statement['qualifiers']['P582']}
+    return pruned_statement
+
+def merge_entity(entity, other_entity):
+
+    # combine the parts of two fetches of the same entity; the labels,
+    # descriptions and sitelinks of the languages in either fetch are kept
+    merged_entity = dict(entity or {}, **other_entity)
+    for k in ('labels', 'descriptions', 'sitelinks'):
+        if k in (entity or {}) and k in other_entity:
+            merged_entity[k] = dict(entity[k], **other_entity[k])
+    return merged_entity
+
+def get_entity_request_ids(ids, content, props, max_ids=50):
+
+    # pack the ids that still need to be fetched into the 'ids' parameter of
+    # as few wbgetentities requests as possible; the api accepts at most 50 ids
+    # per request
+    pending_ids = [i for i in unique_list(ids) if not has_entity_props(content.get('entities', {}).get(i), props)]
+    return ['|'.join(pending_ids[idx:idx+max_ids]) for idx in range(0, len(pending_ids), max_ids)]
+
+def get_json_responses(session, urls, deadline=None):
+
+    # get the json content for the urls at the same time using the async
+    # engine; the responses are returned in the order of the urls and a
+    # request that fails, or can't be made before the deadline, returns the
+    # exception instead of failing the others
+    if len(urls) == 0:
+        return []
+
+    # a single request doesn't need the engine
+    if len(urls) == 1:
+        try:
+            return [get_json(session, urls[0], deadline)]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return [e]
+
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(get_json_responses_async(session, urls, deadline))
+
+    # if we're called from a running event loop, run the engine on its own loop
+    return get_executor().submit(asyncio.run, get_json_responses_async(session, urls, deadline)).result()
+
+async def get_json_responses_async(session, urls, deadline=None):
+
+    # the requests use the shared session on the executor threads, within the
+    # limits on the requests made at the same time (see get_limited_json_request)
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+
+    # a request that's already in flight (e.g. from another call) is waited
+    # on, until the deadline, without taking up a slot or an executor thread
+    async def get_json_response(url):
+        key = normalize_url(url)
+        try:
+            if deadline is not None:
+                deadline.check()
+            future, first = single_flight.join(key)
+            if not first:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), deadline.remaining() if deadline is not None else None)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded('Deadline exceeded')
+            return await loop.run_in_executor(executor, single_flight.run, key, future, get_limited_json_request, session, url, deadline)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return e
+
+    return await asyncio.gather(*[get_json_response(url) for url in urls])
+
+def get_json(session, url, deadline=None):
+    # callers that request the same url at the same time share one request
+    return single_flight.do(normalize_url(url), get_limited_json_request, session, url, deadline, deadline=deadline)
+
+def get_limited_json_request(session, url, deadline=None):
+
+    # the request waits for a slot within HTTP_MAX_CONCURRENCY_PER_HOST
+    # requests at a time to its host and HTTP_MAX_CONCURRENCY overall; the
+    # host's slot is taken first so that a request waiting on its host
+    # doesn't hold up the requests to the other hosts, and a request that
+    # can't get a slot before the deadline fails
+    start = time.perf_counter()
+    acquired = []
+    try:
+        for limit in get_http_limits(urllib.parse.urlparse(url).netloc):
+            if not limit.acquire(timeout=deadline.remaining() if deadline is not None else None):
+                metrics.incr('http.deadline_exceeded')
+                raise DeadlineExceeded('Deadline exceeded')
+            acquired.append(limit)
+        metrics.timing('http.limit_wait', time.perf_counter() - start)
+        return get_json_request(session, url, deadline)
+    finally:
+        for limit in acquired:
+            limit.release()
+
+def normalize_url(url):
+
+    # the key for a request: the url with its query parameters sorted, and
+    # the values of parameters that are sets sorted too
+    parts = urllib.parse.urlsplit(url)
+    query = []
+    for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True):
+        if k in UNORDERED_PARAMS:
+            v = '|'.join(sorted(v.split('|')))
+        query.append((k, v))
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urllib.parse.urlencode(sorted(query)), ''))
+
+def get_json_request(session, url, deadline=None):
+
+    # throttled requests (429/503 responses and maxlag errors) are tried again
+    # here rather than by the session's retry policy so that the host's rate
+    # limiter decides when all the requests to the host go out again; with a
+    # deadline, the request (and the time its retries wait) is kept within
+    # what's left of it
+    rate_limiter = get_rate_limiter(urllib.parse.urlparse(url).netloc)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if attempt > 0:
+            metrics.incr('http.retries')
+        start = time.perf_counter()
+        rate_limiter.acquire(deadline)
+        metrics.timing('http.rate_limit_wait', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        metrics.incr('http.requests')
+        try:
+            request_deadline.deadline = deadline
+            response = session.get(url, timeout=get_request_timeout(deadline))
+        except requests.exceptions.RequestException:
+            metrics.incr('http.errors')
+            raise
+        finally:
+            request_deadline.deadline = None
+        metrics.timing('http.request', time.perf_counter() - start)
+
+        retry_after = get_retry_after(response)
+        if retry_after is None:
+            rate_limiter.on_success()
+            return parse_json_response(response)
+        metrics.incr('http.throttled')
+        rate_limiter.on_throttle(retry_after)
+
+    metrics.incr('http.errors')
+    raise requests.exceptions.RetryError('Request throttled: ' + url, response=response)
+
+def get_request_timeout(deadline):
+
+    # with a deadline, each try of a request can take what's left of it; a
+    # try that fails is only made again when there's time left for it after
+    # the backoff (see DeadlineRetry)
+    if deadline is None or deadline.expires is None:
+        return None
+    deadline.check()
+    return deadline.remaining()
+
+def parse_json_response(response):
+
+    # parse the response body, keeping track of the bytes and time spent;
+    # large batches of entities are decoded in the process pool when there is one
+    content = response.content
+    start = time.perf_counter()
+    value = None
+    if PROCESS_POOL_SIZE > 0 and len(content) >= PROCESS_POOL_MIN_BYTES and 'wbgetentities' in (response.url or ''):
+        value = loads_entities_pooled(content)
+    if value is None:
+        value = loads_json(content)
+    metrics.timing('json.parse', time.perf_counter() - start)
+    metrics.incr('http.bytes', len(content))
+    return value
+
+def loads_entities_pooled(content):
+
+    # decode and prune the entities in the process pool; returns None when
+    # the pool can't be used so that the caller decodes them instead
+    global process_pool_failed
+    pool = get_process_pool()
+    if pool is None:
+        return None
+    try:
+        value = pool.submit(loads_entities, content).result()
+    except Exception:
+        logger.warning('process pool failed, decoding responses in process', exc_info=True)
+        with process_pool_lock:
+            process_pool_failed = True
+        return None
+    metrics.incr('process_pool.responses')
+    return value
+
+def loads_entities(content):
+    # runs in the pool: only the parts of the entities we use are sent back
+    value = loads_json(content)
+    value['entities'] = {k: prune_entity(v, pooled_claim_props) for k, v in value.get('entities', {}).items()}
+    return value
+
+def get_process_pool():
+
+    # create the pool the first time it's used; the workers are forked so
+    # they have the function's code and settings without importing it again
+    global process_pool, process_pool_failed
+    with process_pool_lock:
+        if process_pool is None and not process_pool_failed:
+            import concurrent.futures
+            import multiprocessing
+            try:
+                process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context('fork'))
+            except ValueError:
+                process_pool_failed = True
+        return None if process_pool_failed else process_pool
+
+def get_retry_after(response):
+
+    # get the number of seconds to wait before trying a throttled request
+    # again, or None if the request wasn't throttled
+    throttled = response.status_code in (429, 503) or response.headers.get('MediaWiki-API-Error') == 'maxlag'
+    if not throttled:
+        return None
+
+    retry_after = response.headers.get('Retry-After', '')
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return RATE_LIMIT_RETRY_AFTER
+
+def get_rate_limiter(host):
+    with http_session_lock:
+        if host not in rate_limiters:
+            rate_limiters[host] = RateLimiter(RATE_LIMIT_RATE, RATE_LIMIT_MIN_RATE, RATE_LIMIT_MAX_RATE, RATE_LIMIT_INCREASE)
+        return rate_limiters[host]
+
+def get_rate_limiter_stats():
+
+    # the current rate and the throttling seen for each host
+    with http_session_lock:
+        hosts = list(rate_limiters.items())
+    return {host: rate_limiter.get_stats() for host, rate_limiter in hosts}
+
+def get_single_flight_stats():
+    # the number of requests made and the number shared with another caller
+    return single_flight.get_stats()
+
+def get_executor():
+
+    # create the executor for the async engine the first time it's used
+    import concurrent.futures
+    global http_executor
+    with http_session_lock:
+        if http_executor is None:
+            http_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_MAX_CONCURRENCY+1)
+        return http_executor
+
+def get_http_limits(host):
+
+    # create the overall limit and the host's limit the first time they're used
+    global http_limit
+    with http_session_lock:
+        if http_limit is None:
+            http_limit = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY)
+        if host not in http_host_limits:
+            http_host_limits[host] = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY_PER_HOST)
+        return http_host_limits[host], http_limit
+
+def get_store_connection():
+
+    # open the entity store the first time it's used
+    global store_connection
+    with cache_lock:
+        if store_connection is None:
+            store_connection = sqlite3.connect('file:' + urllib.parse.quote(ENTITY_STORE_PATH) + '?mode=ro', uri=True, check_same_thread=False)
+        return store_connection
+
+def get_store_search_candidate_ids(searches, language):
+
+    # the candidates for a search term are the items with a label or alias
+    # that matches the search term, ranked by the number of sitelinks
+    connection = get_store_connection()
+    search_candidate_ids = {}
+    with cache_lock:
+        for search in searches:
+            store_rows = connection.execute('select id from names where language = ? and name = ? order by weight desc limit ?', [language, normalize_name(search), SEARCH_CANDIDATES])
+            search_candidate_ids[search] = [r[0] for r in store_rows]
+    return search_candidate_ids
+
+def get_store_entities(ids):
+
+    # get the entities from the store; entities that aren't in the store
+    # are returned as missing
+    connection = get_store_connection()
+    entities = {i: {'id': i, 'missing': ''} for i in ids}
+    with cache_lock:
+        for idx in range(0, len(ids), 500):
+            ids_chunk = ids[idx:idx+500]
+            query = 'select id, entity from entities where id in (%s)' % ','.join('?'*len(ids_chunk))
+            for item_id, entity in connection.execute(query, ids_chunk):
+                entities[item_id] = loads_json(entity)
+    return entities
+
+def normalize_name(name):
+    # the same normalization is used for the names in the entity store
+    return ' '.join(name.lower().split())
+
+def get_cache_connection():
+
+    # open the cache the first time it's used; if the cache can't be
+    # opened, run without it
+    global cache_connection
+    if cache_connection is None and CACHE_PATH:
+        try:
+            connection = sqlite3.connect(CACHE_PATH, timeout=10, check_same_thread=False)
+            connection.execute('pragma journal_mode=wal')
+            connection.execute('create table if not exists cache (kind text, key text, item_id text, modified text, expires real, accessed real, value text, primary key (kind, key))')
+            connection.execute('create index if not exists cache_item_id on cache (item_id)')
+            connection.execute('create index if not exists cache_accessed on cache (accessed)')
+            connection.commit()
+            cache_connection = connection
+        except sqlite3.Error:
+            return None
+    return cache_connection
+
+def get_cache_values(kind, keys, stale=False, stale_keys=None):
+
+    # get the unexpired cached values for the keys, keyed by key; with stale,
+    # get the values that have expired but are still kept for revalidation;
+    # when stale_keys is a set, values that expired less than CACHE_STALE_TTL
+    # ago are also returned and their keys are added to it
+    connection = get_cache_connection()
+    if connection is None or len(keys) == 0:
+        return {}
+
+    now = time.time()
+    if stale:
+        expires_range = [now - CACHE_REVALIDATE_TTL, now]
+    else:
+        expires_range = [now - (CACHE_STALE_TTL if stale_keys is not None else 0), float('inf')]
+    values = {}
+    with cache_lock:
+        try:
+            for idx in range(0, len(keys), 500):
+                keys_chunk = keys[idx:idx+500]
+                query = 'select key, expires, value from cache where kind = ? and expires > ? and expires <= ? and key in (%s)' % ','.join('?'*len(keys_chunk))
+                for key, expires, value in connection.execute(query, [kind] + expires_range + keys_chunk):
+                    values[key] = loads_json(value)
+                    if stale_keys is not None and expires <= now:
+                        stale_keys.add(key)
+            connection.executemany('update cache set accessed = ? where kind = ? and key = ?', [(now, kind, k) for k in values.keys()])
+            connection.commit()
+        except sqlite3.Error:
+            pass
+    if stale:
+        return values
+    if len(values) > 0:
+        metrics.incr('cache.' + kind + '.hits', len(values))
+    if stale_keys:
+        metrics.incr('cache.' + kind + '.stale', len(stale_keys))
+    if len(keys) > len(values):
+        metrics.incr('cache.' + kind + '.misses', len(keys) - len(values))
+    return values
+
+def put_cache_values(kind, entries, ttl=None):
+
+    # store a list of (key, item_id, modified, value) entries for the ttl
+    # (CACHE_TTL by default); when an entry has a modified date, entries for
+    # other revisions of the same item are out of date and are removed
+    connection = get_cache_connection()
+    if connection is None or len(entries) == 0:
+        return
+
+    ttl = CACHE_TTL if ttl is None else ttl
+
+    now = time.time()
+    with cache_lock:
+        try:
+            connection.executemany("delete from cache where item_id = ? and modified != '' and modified != ?", [(e[1], e[2]) for e in entries if e[2]])
+            connection.executemany('insert or replace into cache (kind, key, item_id, modified, expires, accessed, value) values (?, ?, ?, ?, ?, ?, ?)',
+                [(kind, e[0], e[1], e[2], now + ttl, now, dumps_json(e[3])) for e in entries])
+            connection.commit()
+        except sqlite3.Error:
+            pass
+
+def touch_cache_values(kind, keys):
+
+    # keep the cached values for the keys for another CACHE_TTL
+    connection = get_cache_connection()
+    if connection is None or len(keys) == 0:
+        return
+
+    now = time.time()
+    with cache_lock:
+        try:
+            connection.executemany('update cache set expires = ?, accessed = ? where kind = ? and key = ?', [(now + CACHE_TTL, now, kind, k) for k in keys])
+            connection.commit()
+        except sqlite3.Error:
+            pass
+
+def trim_cache():
+
+    # remove entries that have expired and are past the time they're kept
+    # for revalidation or used while stale, and evict the least recently
+    # used entries once the cache is over its size limit
+    connection = get_cache_connection()
+    if connection is None:
+        return
+
+    with cache_lock:
+        try:
+            connection.execute('delete from cache where expires <= ?', [time.time() - max(CACHE_REVALIDATE_TTL, CACHE_STALE_TTL, 0)])
+            count = connection.execute('select count(*) from cache').fetchone()[0]
+            if count > CACHE_MAX_ENTRIES:
+                connection.execute('delete from cache where rowid in (select rowid from cache order by accessed limit ?)', [count - CACHE_MAX_ENTRIES])
+            connection.commit()
+        except sqlite3.Error:
+            pass
+
+def get_claim_entity_ids(claim_info):
+    # the ids of the items the claim's values refer to
+    return [d.get('value',{}).get('id','') for d in claim_info.datavalues if d.get('type') == 'wikibase-entityid']
+
+def unique_list(values):
+    # unique values in their original order, without empty values
+    return list(OrderedDict.fromkeys(v for v in values if v))
+
+def update_claim_info(claim_info, object, language, use_ids=False):
+
+    # the value is left unset until the labels of all the items the claim
+    # refers to have been looked up; with use_ids, the items whose labels
+    # couldn't be looked up are given by their ids instead
+    values = [get_datavalue_value(d, object, language) for d in claim_info.datavalues]
+    if use_ids:
+        values = [v if v is not None else d.get('value',{}).get('id','') for v, d in zip(values, claim_info.datavalues)]
+    if any(v is None for v in values):
+        return claim_info
+
+    values = [v for v in values if v != '']
+    if claim_info.policy == 'all':
+        claim_info.value = values
+    elif claim_info.policy == 'joined':
+        claim_info.value = claim_info.separator.join(OrderedDict.fromkeys(values))
+    else:
+        claim_info.value = values[0] if len(values) > 0 else ''
+    return claim_info
+
+def get_datavalue_value(datavalue, object, language):
+    value_type = datavalue.get('type')
+    if value_type == 'wikibase-entityid':
+        entity_id_lookup = datavalue.get('value',{}).get('id','')
+        entity = object.get('entities',{}).get(entity_id_lookup)
+        if has_entity_props(entity, 'labels') or entity_id_lookup == '':
+            label = (entity or {}).get('labels',{}).get(language, {}).get('value','')
+            label_cache.put((entity_id_lookup, language), label)
+            return label
+        return label_cache.get((entity_id_lookup, language))
+    if value_type == 'time':
+        return datavalue.get('value',{}).get('time','')
+    if value_type == 'quantity':
+        return datavalue.get('value',{}).get('amount','')
+    if value_type == 'monolingualtext':
+        return datavalue.get('value',{}).get('text','')
+    if value_type == 'string':
+        return datavalue.get('value','')
+    return ''
+
+def get_claim_statements(statements, claim_property, language):
+
+    # pick the statements to use for the property based on its values
+    # policy, the rank of the statements and, for text values, the language
+    policy = claim_property.get('values', 'preferred')
+    if policy == 'first':
+        return statements[:1]
+
+    statements = [s for s in statements if s.get('rank') != 'deprecated' and s.get('mainsnak',{}).get('datavalue')]
+    if claim_property.get('current'):
+        statements = [s for s in statements if 'P582' not in s.get('qualifiers',{})]
+    statements = [s for s in statements if s.get('rank') == 'preferred'] or statements
+    if claim_property.get('type') == 'monolingualtext':
+        statements = sorted(statements, key=lambda s: s['mainsnak']['datavalue'].get('value',{}).get('language') != language)
+
+    if policy == 'preferred':
+        return statements[:1]
+    return statements
+
+def get_session():
+
+    # create the shared session the first time it's used; throttled requests
+    # are retried by get_json() rather than by the session
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests_retry_session(
+                status_forcelist=(500, 502, 504),
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                pool_block=HTTP_POOL_BLOCK,
+                keep_alive=HTTP_KEEP_ALIVE,
+            )
+        return http_session
+
+def get_session_stats():
+
+    # connection pool statistics for the shared session, keyed by host
+    stats = {}
+    if http_session is None:
+        return stats
+
+    pools = http_session.get_adapter('https://').poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        stats[pool.host] = {
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            'idle_connections': len([c for c in list(pool.pool.queue) if c is not None]) if pool.pool is not None else 0
+        }
+    return stats
+
+def requests_retry_session(
+    retries=3,
+    backoff_factor=0.3,
+    status_forcelist=(500, 502, 504),
+    session=None,
+    pool_connections=10,
+    pool_maxsize=10,
+    pool_block=False,
+    keep_alive=True,
+):
+    # responses with a Retry-After header aren't retried here, whatever their
+    # status, so that get_json_request slows down the host's rate limiter
+    # and keeps the wait within the deadline
+    session = session or requests.Session()
+    retry = DeadlineRetry(
+        total=retries,
+        read=retries,
+        connect=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+def get_validator():
+
+    # define the expected parameters the first time they're needed; the
+    # validator keeps the document it's validating, so it's used by one
+    # call at a time
+    global validator
+    with validator_lock:
+        if validator is None:
+            params = OrderedDict()
+            params['search'] = {'required': True, 'type': ['string', 'list']}
+            params['properties'] = {'required': False, 'validator': validator_list, 'coerce': to_list, 'default': 'description'}
+            params['language'] = {'required': False, 'validator': validator_list, 'coerce': to_list, 'default': 'en'}
+            validator = Validator(params, allow_unknown = True)
+        return validator
+
+def loads_json(content):
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(content)
+    return json.loads(content)
+
+def dumps_json(value):
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(value, default=to_string).decode('utf-8')
+    return json.dumps(value, default=to_string)
+
+def add_metrics_hook(hook):
+    # the hook is called with the kind ('counter' or 'timer'), the name and
+    # the value (a count or seconds) of each update
+    metrics.add_hook(hook)
+
+def get_metrics_text():
+
+    # the metrics in the prometheus text exposition format; counters are
+    # exported as <prefix>_<name>_total and timers as summaries in seconds
+    stats = metrics.get_stats()
+    lines = []
+    for name, value in sorted(stats['counters'].items()):
+        metric_name = get_metric_name(name) + '_total'
+        lines.append('# TYPE %s counter' % metric_name)
+        lines.append('%s %d' % (metric_name, value))
+    for name, timer in sorted(stats['timers'].items()):
+        metric_name = get_metric_name(name) + '_seconds'
+        lines.append('# TYPE %s summary' % metric_name)
+        lines.append('%s_count %d' % (metric_name, timer['count']))
+        lines.append('%s_sum %f' % (metric_name, timer['sum']))
+        lines.append('# TYPE %s_max gauge' % metric_name)
+        lines.append('%s_max %f' % (metric_name, timer['max']))
+    return '\n'.join(lines) + '\n'
+
+def get_metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', METRICS_PREFIX + '_' + name)
+
+def get_stats():
+
+    # the statistics of the metrics, requests and caches the functions share
+    stats = metrics.get_stats()
+    stats.update({
+        'json': get_json_stats(),
+        'sessions': get_session_stats(),
+        'rate_limiters': get_rate_limiter_stats(),
+        'single_flight': get_single_flight_stats(),
+        'label_cache': label_cache.get_stats()
+    })
+    return stats
+
+def get_json_stats():
+
+    # the number of responses parsed, their size in bytes and the time spent
+    # parsing them, along with the peak resident set size of the process
+    # (in kilobytes on linux)
+    stats = metrics.get_stats()
+    parse_timer = stats['timers'].get('json.parse', {})
+    stats = {
+        'backend': JSON_BACKEND,
+        'responses': parse_timer.get('count', 0),
+        'bytes': stats['counters'].get('http.bytes', 0),
+        'parse_seconds': parse_timer.get('sum', 0.0)
+    }
+    try:
+        import resource
+        stats['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        stats['peak_rss'] = None
+    return stats
+
+def validator_list(field, value, error):
+    if isinstance(value, str):
+        return
+    if isinstance(value, list):
+        for item in value:
+            if not isinstance(item, str):
+                error(field, 'Must be a list with only string values')
+        return
+    error(field, 'Must be a string or a list of strings')
+
+def to_string(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (Decimal)):
+        return str(value)
+    return value
+
+def to_list(value):
+    # if we have a list of strings, create a list from them; if we have
+    # a list of lists, flatten it into a single list of strings; strings
+    # in the list are kept whole
+    if isinstance(value, str):
+        return value.split(",")
+    if isinstance(value, list):
+        return list(itertools.chain.from_iterable(v if isinstance(v, list) else [v] for v in value))
+    return None
+